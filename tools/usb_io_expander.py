@@ -11,13 +11,18 @@
 #
 
 
+import inspect
 import sys
+import time
 import serial
+from usb_io_expander_commands import command_table, command_encoders, data_commands, max_command_length
 
 # Default settings.
 default_baudrate = 115200
 default_comport = "com3"
 ser = serial.Serial()
+# Incremented each time an IIC bus could have changed (IIC init or reset) so cached IIC data can be refreshed.
+iic_bus_generation = 0
 
 # Set the default comport. Default is com3 under Windows.
 def get_default_comport():
@@ -28,16 +33,21 @@ def get_default_comport():
     else:
         return default_comport
 
+# Apply the USB IO Expander serial settings to the given serial port object.
+def serial_configure(serial_port, which_port):
+    serial_port.port = which_port
+    serial_port.baudrate = default_baudrate
+    serial_port.bytesize = 8
+    serial_port.parity = 'N'
+    serial_port.stopbits = 1
+    serial_port.timeout = 3  # 3 seconds wait timeout for reading response. Programming may take some time.
+    serial_port.xonxoff = 0
+    serial_port.rtscts = 1  # RTS/CTS must be enabled!
+
 # Initialize and open the serial port. Returns True when successful.
 def serial_init(which_port):
-    ser.port = which_port
-    ser.baudrate = default_baudrate
-    ser.bytesize = 8
-    ser.parity = 'N'
-    ser.stopbits = 1
-    ser.timeout = 3  # 3 seconds wait timeout for reading response. Programming may take some time.
-    ser.xonxoff = 0
-    ser.rtscts = 1  # RTS/CTS must be enabled!
+    serial_configure(ser, which_port)
+    line_reader(ser).clear()
     try:
         ser.open()
         if ser.is_open:
@@ -52,6 +62,21 @@ def serial_init(which_port):
         print("Could not open serial port:",which_port)
         return False
 
+# Open an additional serial port, e.g. when controlling more than one USB IO Expander.
+# Returns the opened serial port or None when it could not be opened.
+def serial_open(which_port):
+    serial_port = serial.Serial()
+    serial_configure(serial_port, which_port)
+    try:
+        serial_port.open()
+    except:
+        pass
+    if serial_port.is_open:
+        return serial_port
+    else:
+        print("Could not open serial port:",which_port)
+        return None
+
 # Close the serial port.
 def serial_end():
     try:
@@ -73,260 +98,178 @@ def is_end_of_line(character):
     else:
         return False
 
+# Reads complete lines from a serial port. Instead of reading one character per call, all characters that
+# are available are read at once and split into lines. A partial line is kept until the rest is received.
+class LineReader:
+    def __init__(self, serial_port):
+        self.serial_port = serial_port
+        self._buffer = bytearray()
+        self._lines = []
+        self._next_line = 0
+
+    # Remove all received characters and lines.
+    def clear(self):
+        del self._buffer[:]
+        self._lines = []
+        self._next_line = 0
+
+    # Return the next line without CR/LF or an empty line when no line was received within the timeout.
+    def read_line(self):
+        if self._next_line < len(self._lines):
+            line = self._lines[self._next_line]
+            self._next_line = self._next_line + 1
+            return line
+        timeout = self.serial_port.timeout
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        while True:
+            # Read at least one character, this waits for the timeout when nothing is available.
+            data = self.serial_port.read(max(1, self.serial_port.in_waiting))
+            if data:
+                self._buffer += data
+                end = max(self._buffer.rfind(b'\n'), self._buffer.rfind(b'\r'))
+                if end >= 0:
+                    # Lines end with CR, LF or CR + LF. Empty lines are skipped.
+                    lines = bytes(self._buffer[:end]).replace(b'\r', b'\n').split(b'\n')
+                    del self._buffer[:end + 1]
+                    self._lines = [line for line in lines if line]
+                    self._next_line = 0
+                    if self._lines:
+                        self._next_line = 1
+                        return self._lines[0]
+            if (timeout is not None) and (time.monotonic() >= deadline):
+                return b''
+
+# Line readers per serial port.
+_line_readers = {}
+
+# Return the line reader of the given serial port.
+def line_reader(serial_port=ser):
+    reader = _line_readers.get(id(serial_port))
+    if (reader is None) or (reader.serial_port is not serial_port):
+        reader = LineReader(serial_port)
+        _line_readers[id(serial_port)] = reader
+    return reader
+
+# Remove all received data of the given serial port, including lines not yet handled.
+def serial_flush_input(serial_port=ser):
+    serial_port.reset_input_buffer()
+    line_reader(serial_port).clear()
+
 # Checks if the response is "0" (OK), if so TRUE is returned.
-def response_ok():
+def response_ok(serial_port=ser):
     # Response format is: b'0\r\n'. 0 for OK or any other for not OK.
-    response = ser.readline()
-    if response == b'0\r\n':
+    response = line_reader(serial_port).read_line()
+    if response == b'0':
         return True
     else:
         return False
 
 # Read an answer containing hex data and return the data in a list and TRUE when OK.
-def get_hex_data():
+def get_hex_data(serial_port=ser):
     hex_data = []
     data_ok = True
     # Now read the data.
-    data_read = ser.readline()
+    data_read = line_reader(serial_port).read_line()
     # The first character of a response always starts with '?' (63).
-    if data_read[0] == 63:
+    if (len(data_read) > 0) and (data_read[0] == 63):
         index = 1 # Skip the first character ('?').
-        stop = False
-        # Continue until all characters processed or in case of end of line reached.
-        while (index < (len(data_read) - 1)) and not stop:
-            data = data_read[index]
-            if is_end_of_line(data):
-                stop = True
-            else:
-                hex_high = convert_hex_ascii_to_decimal(data)
-                index = index + 1
-                data = data_read[index]
-                if is_end_of_line(data):
-                    stop = True
-                else:
-                    hex_low = convert_hex_ascii_to_decimal(data)
-                    index = index + 1
-                    hex_byte = (16 * hex_high) + hex_low
-                    hex_data.append(hex_byte)
+        # Each byte is given as two hexadecimal characters.
+        while index < (len(data_read) - 1):
+            hex_high = convert_hex_ascii_to_decimal(data_read[index])
+            hex_low = convert_hex_ascii_to_decimal(data_read[index + 1])
+            hex_byte = (16 * hex_high) + hex_low
+            hex_data.append(hex_byte)
+            index = index + 2
     else:
         data_ok = False # Answer did not start with '?'
     return data_ok, hex_data
 
-# Set the given pin (0..7) to the given direction (0 = output, 1 = input)
-def pin_bit_direction(pin, direction):
-    serialcommand = '!PID{:02X}{:02X}\r\n'.format(pin, direction)
-    ser.write(serialcommand.encode())
-    return response_ok()
-
-# Set the given pin (0, 1, 2, 3 or 6) to the given mode (0 = digital, 1 = analog)
-def pin_bit_mode(pin, mode):
-    serialcommand = '!PIM{:02X}{:02X}\r\n'.format(pin, mode)
-    ser.write(serialcommand.encode())
-    return response_ok()
-
-# Set the given pin (6 or 7) to the given pull-up (0 = disabled, 1 = enabled)
-def pin_bit_pull_up(pin, pull_up):
-    serialcommand = '!PIP{:02X}{:02X}\r\n'.format(pin, pull_up)
-    ser.write(serialcommand.encode())
-    return response_ok()
-
-# Set the given pin (0..7) to the given value (0 = low, 1 = high)
-def pin_bit_write(pin, value):
-    serialcommand = '!PIW{:02X}{:02X}\r\n'.format(pin, value)
-    ser.write(serialcommand.encode())
-    return response_ok()
-
-# Set the all pins (0..7) of the given bits in the given direction (0 = output, 1 = input)
-def pin_byte_direction(direction):
-    serialcommand = '!PYD{:02X}\r\n'.format(direction)
-    ser.write(serialcommand.encode())
-    return response_ok()
-
-# Set the all pins (0..7) to the given bits in the parameter value (0 = low, 1 = high)
-def pin_byte_write(value):
-    serialcommand = '!PYW{:02X} \r\n'.format(value)
-    ser.write(serialcommand.encode())
-    return response_ok()
-
-# Return the status of the given pin (0 = low, 1 = high).
-def pin_bit_read(pin):
-    serialcommand = '!PIR{:02X}\r\n'.format(pin)
-    ser.write(serialcommand.encode())
-    pin_status = []  # Dummy in case of no response.
-    if response_ok():
-        # Get the returned data.
-        return get_hex_data()
-    else:
-        return False, pin_status
-
-# Return the status of the given port.
-def pin_byte_read():
-    serialcommand = '!PYR\r\n'
-    ser.write(serialcommand.encode())
-    port_status = [] # Dummy in case of no response.
-    if response_ok():
-        # Get the returned data.
-        return get_hex_data()
-    else:
-        return False, port_status
-
-# Initialize the IIC interface with the given bus speed (1 = 100kHz, 4 = 400 kHz).
-# Returns TRUE when successful.
-def iic_init(bus_speed):
-    serialcommand = '!IICI{:02X}\r\n'.format(bus_speed)
-    ser.write(serialcommand.encode())
-    return response_ok()
-
-# Write the given IIC data to an IIC device.
-# Returns TRUE when successful.
-def iic_write(slave_address, iic_write_data=[]):
-    serialcommand = '!IICW{:02X}'.format(slave_address)
-    ser.write(serialcommand.encode())
-    # Now send all data to write in hexadecimal notation.
-    for data in iic_write_data:
-        hex_byte = ("{:02X}".format(data))
-        ser.write(hex_byte.encode())
-    serialcommand = '\r\n'
-    ser.write(serialcommand.encode())
-    return response_ok()
-
-# Read IIC data from an IIC device.
-# Returns TRUE and the data read when successful.
-def iic_read(slave_address, nr_of_bytes):
-    serialcommand = '!IICR{:02X}{:02X}\r\n'.format(slave_address, nr_of_bytes)
-    ser.write(serialcommand.encode())
-    iic_read_data = [] # Dummy in case of no response.
-    if response_ok():
-        # Get the returned data.
-        return get_hex_data()
-    else:
-        return False, iic_read_data
-
-# Initialize the DAC wit the given channel (1 or 2).
-# Returns TRUE when successful.
-def dac_init(channel):
-    serialcommand = '!DACI{:02X}\r\n'.format(channel)
-    ser.write(serialcommand.encode())
-    return response_ok()
-
-# Enable the DAC.
-# Returns TRUE when successful.
-def dac_enable():
-    ser.write(b'!DACE\r\n')
-    return response_ok()
-
-# Disable the DAC.
-# Returns TRUE when successful.
-def dac_disable():
-    ser.write(b'!DACD\r\n')
-    return response_ok()
-
-# Set the DAC to the given value (0..31).
-# Returns TRUE when successful.
-def dac_write(value):
-    serialcommand = '!DACW{:02X}\r\n'.format(value)
-    ser.write(serialcommand.encode())
-    return response_ok()
-
-# Initialize the SPI interface with the given mode and speed.
-# Returns TRUE when successful.
-def spi_init(mode, speed):
-    serialcommand = '!SPII{:02X}{:02X}\r\n'.format(mode, speed)
-    ser.write(serialcommand.encode())
-    return response_ok()
-
-# Write the given SPI data. Returns TRUE when successful.
-def spi_write(spi_write_data=[]):
-    serialcommand = '!SPIW'
-    ser.write(serialcommand.encode())
-    # Now send all data to write in hexadecimal notation.
-    for data in spi_write_data:
-        hex_byte = ("{:02X}".format(data))
-        ser.write(hex_byte.encode())
-    serialcommand = '\r\n'
-    ser.write(serialcommand.encode())
-    return response_ok()
-
-# Write the SPI data for the given number of bytes.
-# Returns TRUE when successful.
-def spi_read(nr_of_bytes):
-    serialcommand = '!SPIR{:02X}\r\n'.format(nr_of_bytes)
-    ser.write(serialcommand.encode())
-    spi_read_data = []  # Dummy in case of no response.
-    if response_ok():
-        # Get the returned data.
-        return get_hex_data()
-    else:
-        return False, spi_read_data
-    return response_ok()
-
-# Initialize the ADC with the given channel (3, 4, 5, 6, or 7).
-# Returns TRUE when successful.
-def adc_init(channel):
-    serialcommand = '!ADCI{:02X}\r\n'.format(channel)
-    ser.write(serialcommand.encode())
-    return response_ok()
-
-# Enable the adc.
-# Returns TRUE when successful.
-def adc_enable():
-    ser.write(b'!ADCE\r\n')
-    return response_ok()
-
-# Disable the ADC.
-# Returns TRUE when successful.
-def adc_disable():
-    ser.write(b'!ADCD\r\n')
-    return response_ok()
-
-# Select an ADC channel. ADC must be initialized.
-def adc_channel(channel):
-    serialcommand = '!ADCC{:02X}\r\n'.format(channel)
-    ser.write(serialcommand.encode())
-    return response_ok()
-
-# Get the ADC value.
-# Returns TRUE when successful.
-def adc_read():
-    ser.write(b'!ADCR\r\n')
-    adc_data = []  # Dummy in case of no response.
-    if response_ok():
-        # Get the returned data.
-        return get_hex_data()
+# Commands after which devices on the IIC bus must be assumed to be changed.
+iic_bus_commands = ('!IICI', '!RES')
+
+# Mark that the IIC bus could have changed.
+def iic_bus_changed():
+    global iic_bus_generation
+    iic_bus_generation = iic_bus_generation + 1
+
+# Return the given commands (e.g. ['!PYW55', '!ADCR']) as one block of bytes ready to be written.
+def command_encode(commands):
+    serialcommand = ''
+    for command in commands:
+        serialcommand = serialcommand + command + '\r\n'
+    return serialcommand.encode()
+
+# Collect the responses of the given commands after they were written.
+# Returns a list with for each command TRUE and the data read (empty when no data) when OK.
+def command_responses(commands, serial_port=ser):
+    results = []
+    for command in commands:
+        if command.upper().startswith(iic_bus_commands):
+            iic_bus_changed()
+        if response_ok(serial_port):
+            if command_returns_data(command):
+                results.append(get_hex_data(serial_port))
+            else:
+                results.append((True, []))
+        else:
+            results.append((False, []))
+    return results
+
+# Send all given commands in one write and collect the responses. The USB IO Expander
+# handles the commands in order so there is no need to wait for a response per command.
+def command_exchange(commands, serial_port=ser):
+    serial_port.write(command_encode(commands))
+    return command_responses(commands, serial_port)
+
+# Returns TRUE if the given command returns data after the response.
+def command_returns_data(command):
+    return command.upper().startswith(data_commands)
+
+# Create the function of a command table entry. The function sends the command and returns TRUE when
+# successful or, for commands returning data, TRUE and the data. Arguments out of range are not sent and
+# return FALSE (and no data), a wrong number of arguments raises TypeError.
+def _make_command_function(name, token, arguments, response, description):
+    encoder = command_encoders[name]
+    changes_iic_bus = token in iic_bus_commands
+    parameters = []
+    for argument_name, width, valid in arguments:
+        if width == 0:
+            # A list of bytes may be left out.
+            parameters.append(inspect.Parameter(argument_name, inspect.Parameter.POSITIONAL_OR_KEYWORD, default=()))
+        else:
+            parameters.append(inspect.Parameter(argument_name, inspect.Parameter.POSITIONAL_OR_KEYWORD))
+    signature = inspect.Signature(parameters)
+
+    def command_function(*values, **named_values):
+        bound = signature.bind(*values, **named_values)
+        bound.apply_defaults()
+        command = encoder(*bound.args)
+        if command is None:
+            if response == 'data':
+                return False, []
+            return False
+        ser.write((command + '\r\n').encode())
+        if changes_iic_bus:
+            iic_bus_changed()
+        if response == 'data':
+            if response_ok():
+                return get_hex_data()
+            return False, []
+        return response_ok()
+
+    command_function.__name__ = name
+    command_function.__qualname__ = name
+    command_function.__signature__ = signature
+    if response == 'data':
+        command_function.__doc__ = description + '\nReturns TRUE and the data read when successful.'
     else:
-        return False, adc_data
-
-# Initialize the PWM wit the given channel (1 or 2).
-# Returns TRUE when successful.
-def pwm_init(channel):
-    serialcommand = '!PWMI{:02X}\r\n'.format(channel)
-    ser.write(serialcommand.encode())
-    return response_ok()
-
-# Enable the given PWM channel.
-# Returns TRUE when successful.
-def pwm_enable(channel):
-    serialcommand = '!PWME{:02X}\r\n'.format(channel)
-    ser.write(serialcommand.encode())
-    return response_ok()
-
-# Disable the given PWM channel.
-# Returns TRUE when successful.
-def pwm_disable(channel):
-    serialcommand = '!PWMD{:02X}\r\n'.format(channel)
-    ser.write(serialcommand.encode())
-    return response_ok()
+        command_function.__doc__ = description + '\nReturns TRUE when successful.'
+    return command_function
 
-# Set the PWM frequency
-# Returns TRUE when successful.
-def pwm_frequency(frequency):
-    serialcommand = '!PWMF{:04X}\r\n'.format(frequency)
-    ser.write(serialcommand.encode())
-    return response_ok()
+# Generate the command functions: reset, ping, pin_bit_direction, .. pwm_duty_cyle.
+def _generate_commands():
+    for name, token, arguments, response, description in command_table:
+        globals()[name] = _make_command_function(name, token, arguments, response, description)
 
-# Set the PWM duty cycle for the given channel
-# Returns TRUE when successful.
-def pwm_duty_cyle(channel, duty_cycle):
-    serialcommand = '!PWMC{:02X}{:02X}\r\n'.format(channel, duty_cycle)
-    ser.write(serialcommand.encode())
-    return response_ok()
+_generate_commands()
@@ -0,0 +1,191 @@
+#
+# Title: USB IO Expander read cache.
+#
+# Author: Rob Jansen, Copyright (c) 2024..2024, all rights reserved.
+#
+# Description: Python script for sharing the results of pin and ADC reads between many users of the same
+#              USB IO Expander. Each query type has a maximum staleness, a result that is not older is
+#              returned from the cache. Identical requests that arrive while a read is in progress wait for
+#              that read instead of sending their own (single flight). A pin bit read is answered from a
+#              pin byte read when all pins are input. Commands sent through the cache that change the state
+#              of the pins or the ADC remove the affected results from the cache so the bus load depends on
+#              the needed freshness of the data and not on the number of users.
+#
+
+import threading
+import time
+from usb_io_expander import ser, command_exchange, command_encoders
+
+# Default maximum staleness in seconds per query type.
+default_staleness = {'pin_byte_read': 0.005, 'pin_bit_read': 0.005, 'adc_read': 0.005}
+
+# State groups and the commands that change them. A reset changes all groups.
+state_pins = 'pins'
+state_adc = 'adc'
+state_changes = {'!PID': (state_pins,), '!PIM': (state_pins,), '!PIP': (state_pins,), '!PIW': (state_pins,),
+                 '!PYD': (state_pins,), '!PYW': (state_pins,), '!IICI': (state_pins,), '!SPII': (state_pins,),
+                 '!DACI': (state_pins,), '!PWMI': (state_pins,), '!PWMC': (state_pins,),
+                 '!ADCI': (state_pins, state_adc), '!ADCC': (state_pins, state_adc), '!ADCE': (state_adc,),
+                 '!ADCD': (state_adc,), '!RES': (state_pins, state_adc)}
+
+
+# Returns the state groups changed by the given command.
+def changed_state(command):
+    command = command.upper()
+    for token, groups in state_changes.items():
+        if command.startswith(token):
+            return groups
+    return ()
+
+
+# A read that is in progress. Requests for the same data wait for it.
+class _Flight:
+    def __init__(self, generation):
+        self.generation = generation
+        self.done = threading.Event()
+        self.result = (False, [])
+
+
+class ReadCache:
+    # Staleness is a dictionary with the maximum staleness in seconds per query type, see default_staleness.
+    def __init__(self, serial_port=ser, staleness=None):
+        self.serial_port = serial_port
+        self.staleness = dict(default_staleness)
+        if staleness is not None:
+            self.staleness.update(staleness)
+        self._lock = threading.Lock()
+        self._device_lock = threading.Lock()
+        self._entries = {}      # Key -> (time, result).
+        self._flights = {}      # Key -> _Flight.
+        self._generation = {state_pins: 0, state_adc: 0}
+        self._byte_read_available = True
+        # Statistics.
+        self.hits = 0           # Requests answered from the cache.
+        self.collapsed = 0      # Requests that waited for a read in progress.
+        self.device_reads = 0   # Reads sent to the device.
+        self.derived = 0        # Pin bit reads answered from a pin byte read.
+        self.invalidations = 0
+
+    # Return the statistics in a dictionary.
+    def statistics(self):
+        with self._lock:
+            return {'hits': self.hits, 'collapsed': self.collapsed, 'device_reads': self.device_reads,
+                    'derived': self.derived, 'invalidations': self.invalidations}
+
+    # Remove the results of the given state groups from the cache, all results when no groups are given.
+    def invalidate(self, groups=(state_pins, state_adc)):
+        with self._lock:
+            for group in groups:
+                self._generation[group] = self._generation[group] + 1
+                for key in list(self._entries):
+                    if key[0] == group:
+                        del self._entries[key]
+                if group == state_pins:
+                    self._byte_read_available = True
+            self.invalidations = self.invalidations + 1
+
+    # Return the result of the given read command for the given key, from the cache when fresh enough.
+    def _read(self, key, command, staleness):
+        with self._lock:
+            entry = self._entries.get(key)
+            if (entry is not None) and (time.monotonic() - entry[0] <= staleness):
+                self.hits = self.hits + 1
+                return entry[1]
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.collapsed = self.collapsed + 1
+                leader = False
+            else:
+                flight = _Flight(self._generation[key[0]])
+                self._flights[key] = flight
+                self.device_reads = self.device_reads + 1
+                leader = True
+        if not leader:
+            flight.done.wait()
+            return flight.result
+        request_time = time.monotonic()
+        try:
+            with self._device_lock:
+                flight.result = command_exchange([command], self.serial_port)[0]
+        finally:
+            with self._lock:
+                del self._flights[key]
+                # Do not cache a result that may be from before a state change.
+                if flight.result[0] and (flight.generation == self._generation[key[0]]):
+                    self._entries[key] = (request_time, flight.result)
+            flight.done.set()
+        return flight.result
+
+    # Return the status of the port. All pins must be input.
+    def pin_byte_read(self):
+        return self._read((state_pins, 'byte'), '!PYR', self.staleness['pin_byte_read'])
+
+    # Return the status of the given pin (0 = low, 1 = high). The pin must be input.
+    def pin_bit_read(self, pin):
+        command = command_encoders['pin_bit_read'](pin)
+        if command is None:
+            return False, []
+        staleness = self.staleness['pin_bit_read']
+        if self._byte_read_available:
+            command_ok, port_status = self._read((state_pins, 'byte'), '!PYR', staleness)
+            if command_ok and (len(port_status) == 1):
+                with self._lock:
+                    self.derived = self.derived + 1
+                return True, [(port_status[0] >> pin) & 0x01]
+            # Not all pins are input, use pin bit reads until the pin state changes.
+            with self._lock:
+                self._byte_read_available = False
+        return self._read((state_pins, 'bit', pin), command, staleness)
+
+    # Get the ADC value. The ADC must be initialized and enabled.
+    def adc_read(self):
+        return self._read((state_adc,), '!ADCR', self.staleness['adc_read'])
+
+    # Send the given commands and remove the results affected by these commands from the cache.
+    # Returns the results of the commands.
+    def execute(self, commands):
+        groups = set()
+        for command in commands:
+            groups.update(changed_state(command))
+        try:
+            with self._device_lock:
+                results = command_exchange(commands, self.serial_port)
+        finally:
+            if groups:
+                self.invalidate(groups)
+        return results
+
+    # Send one command of the command table with the given arguments. Returns FALSE for invalid arguments.
+    def _command(self, name, *arguments):
+        command = command_encoders[name](*arguments)
+        if command is None:
+            return False
+        return self.execute([command])[0][0]
+
+    # Set the given pin (0..7) to the given direction (0 = output, 1 = input)
+    def pin_bit_direction(self, pin, direction):
+        return self._command('pin_bit_direction', pin, direction)
+
+    # Set the given pin (0, 1, 2, 3 or 6) to the given mode (0 = digital, 1 = analog)
+    def pin_bit_mode(self, pin, mode):
+        return self._command('pin_bit_mode', pin, mode)
+
+    # Set the given pin (6 or 7) to the given pull-up (0 = disabled, 1 = enabled)
+    def pin_bit_pull_up(self, pin, pull_up):
+        return self._command('pin_bit_pull_up', pin, pull_up)
+
+    # Set the given pin (0..7) to the given value (0 = low, 1 = high)
+    def pin_bit_write(self, pin, value):
+        return self._command('pin_bit_write', pin, value)
+
+    # Set the all pins (0..7) of the given bits in the given direction (0 = output, 1 = input)
+    def pin_byte_direction(self, direction):
+        return self._command('pin_byte_direction', direction)
+
+    # Set the all pins (0..7) to the given bits in the parameter value (0 = low, 1 = high)
+    def pin_byte_write(self, value):
+        return self._command('pin_byte_write', value)
+
+    # Select an ADC channel. ADC must be initialized.
+    def adc_channel(self, channel):
+        return self._command('adc_channel', channel)
@@ -0,0 +1,238 @@
+#
+# Title: USB IO Expander command line interface.
+#
+# Author: Rob Jansen, Copyright (c) 2024..2024, all rights reserved.
+#
+# Description: Python script for controlling the USB IO Expander from the command line. There is a subcommand
+#              for every command of the USB IO Expander, e.g.:
+#                  python usb_io_expander_cli.py --port /dev/ttyACM0 pin_byte_write 0x55
+#                  python usb_io_expander_cli.py --format json adc_read
+#              The shell subcommand starts an interactive shell with history that keeps the serial port open.
+#              In the shell more commands can be given on one line separated by ';', these are sent in one
+#              pipelined exchange. Output is one line per command: 'ok' followed by the data in hexadecimal,
+#              'error' when the device did not accept the command and 'invalid' for invalid arguments which
+#              are not sent. With --format json each line is a JSON object.
+#              The serial library is only imported when a device command is executed so help and argument
+#              checking start fast. The main function can be used as entry point.
+#
+
+import os
+import sys
+from usb_io_expander_commands import command_table, command_encoders
+
+history_file = os.path.join(os.path.expanduser('~'), '.usb_io_expander_history')
+
+
+# Returns the number given in decimal or, when starting with 0x, hexadecimal notation.
+def parse_number(text):
+    return int(text, 0)
+
+
+# Create the command line parser with a subcommand per command of the command table.
+def build_parser():
+    import argparse
+    parser = argparse.ArgumentParser(prog='usb_io_expander_cli',
+                                     description='Control the USB IO Expander from the command line.')
+    parser.add_argument('-p', '--port', help='serial port, default depends on the operating system')
+    parser.add_argument('-f', '--format', choices=('text', 'json'), default='text', help='output format')
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    for name, token, arguments, response, description in command_table:
+        subparser = subparsers.add_parser(name, help=description.replace('%', '%%'))
+        for argument_name, width, values in arguments:
+            if width == 0:
+                subparser.add_argument(argument_name, type=parse_number, nargs='*', help='list of bytes')
+            else:
+                subparser.add_argument(argument_name, type=parse_number)
+    subparsers.add_parser('shell', help='interactive shell keeping the serial port open')
+    return parser
+
+
+# Returns the output line for the result of the given command. An error text is added as 'error' field in
+# JSON and as comment in text.
+def format_result(name, status, data, output_format, error=None):
+    if output_format == 'json':
+        import json
+        result = {'command': name, 'status': status, 'data': data}
+        if error is not None:
+            result['error'] = error
+        return json.dumps(result)
+    line = status
+    if data:
+        line = line + ' ' + ' '.join('{:02X}'.format(value) for value in data)
+    if error is not None:
+        line = line + ' # ' + error
+    return line
+
+
+# Open the serial port, the serial library is imported here. Returns the serial port and None or, when the
+# port could not be opened, None and the error text.
+def open_device(port):
+    import serial
+    import usb_io_expander
+    if port is None:
+        port = usb_io_expander.get_default_comport()
+    serial_port = usb_io_expander.ser
+    usb_io_expander.serial_configure(serial_port, port)
+    usb_io_expander.line_reader(serial_port).clear()
+    try:
+        serial_port.open()
+    except (serial.SerialException, ValueError) as error:
+        return None, 'could not open serial port {}: {}'.format(port, error)
+    return serial_port, None
+
+
+# Execute the given list of (name, arguments) in one pipelined exchange. Commands with invalid arguments
+# are not sent. Returns a list of (name, status, data).
+def execute(serial_port, requests):
+    from usb_io_expander import command_exchange
+    commands = []
+    for name, arguments in requests:
+        commands.append(command_encoders[name](*arguments))
+    sent = [command for command in commands if command is not None]
+    results = []
+    if sent:
+        results = command_exchange(sent, serial_port)
+    output = []
+    for (name, arguments), command in zip(requests, commands):
+        if command is None:
+            output.append((name, 'invalid', []))
+        else:
+            command_ok, data = results.pop(0)
+            output.append((name, 'ok' if command_ok else 'error', data))
+    return output
+
+
+# Returns (name, arguments) of a command given as text, e.g. 'iic_write 0x40 0x09 0xFF'.
+# Raises ValueError for an unknown command or an argument that is not a number.
+def parse_request(text):
+    words = text.split()
+    if words[0] not in command_encoders:
+        raise ValueError('unknown command: ' + words[0])
+    arguments = []
+    for name, token, table_arguments, response, description in command_table:
+        if name == words[0]:
+            values = [parse_number(word) for word in words[1:]]
+            for argument_name, width, valid in table_arguments:
+                if width == 0:
+                    arguments.append(values)
+                    values = []
+                elif values:
+                    arguments.append(values.pop(0))
+            if values:
+                raise ValueError('too many arguments for: ' + words[0])
+    return words[0], arguments
+
+
+# Print the commands and their arguments, in JSON one object per command.
+def print_commands(output_format='text'):
+    for name, token, arguments, response, description in command_table:
+        names = []
+        for argument_name, width, values in arguments:
+            if width == 0:
+                names.append('[' + argument_name + ' ...]')
+            else:
+                names.append(argument_name)
+        if output_format == 'json':
+            import json
+            print(json.dumps({'command': name, 'arguments': names, 'description': description}))
+        else:
+            print(name, ' '.join(names))
+
+
+# Interactive shell, returns the exit code. The banner and prompt are only shown when the input is a terminal
+# so the output of commands piped into the shell can be parsed.
+def run_shell(serial_port, output_format):
+    import serial
+    from usb_io_expander import serial_flush_input
+    interactive = sys.stdin.isatty()
+    prompt = ''
+    if interactive:
+        prompt = '> '
+    try:
+        import readline
+        try:
+            readline.read_history_file(history_file)
+        except OSError:
+            pass
+    except ImportError:
+        readline = None
+    if interactive:
+        print("USB IO Expander shell. Type 'help' for the commands, 'quit' to stop.")
+    try:
+        while True:
+            try:
+                line = input(prompt).strip()
+            except EOFError:
+                if interactive:
+                    print()
+                break
+            if not line:
+                continue
+            if line in ('quit', 'exit'):
+                break
+            if line == 'help':
+                print_commands(output_format)
+                continue
+            try:
+                requests = [parse_request(text) for text in line.split(';') if text.strip()]
+            except ValueError as error:
+                print(format_result(line, 'invalid', [], output_format, str(error)))
+                continue
+            try:
+                output = execute(serial_port, requests)
+            except serial.SerialException as error:
+                # Keep the shell running, remove responses that may be left behind.
+                print(format_result(line, 'error', [], output_format, str(error)))
+                try:
+                    serial_flush_input(serial_port)
+                except serial.SerialException:
+                    pass
+                continue
+            for name, status, data in output:
+                print(format_result(name, status, data, output_format))
+    except KeyboardInterrupt:
+        print()
+    if readline is not None:
+        try:
+            readline.write_history_file(history_file)
+        except OSError:
+            pass
+    return 0
+
+
+def main(argv=None):
+    parser = build_parser()
+    options = parser.parse_args(argv)
+    if options.command is None:
+        parser.print_help()
+        return 2
+    if options.command != 'shell':
+        for name, token, arguments, response, description in command_table:
+            if name == options.command:
+                values = [getattr(options, argument[0]) for argument in arguments]
+        if command_encoders[options.command](*values) is None:
+            print(format_result(options.command, 'invalid', [], options.format))
+            return 1
+    serial_port, error = open_device(options.port)
+    if serial_port is None:
+        print(format_result(options.command, 'error', [], options.format, error))
+        return 1
+    import serial
+    try:
+        if options.command == 'shell':
+            return run_shell(serial_port, options.format)
+        try:
+            name, status, data = execute(serial_port, [(options.command, values)])[0]
+        except serial.SerialException as error:
+            print(format_result(options.command, 'error', [], options.format, str(error)))
+            return 1
+        print(format_result(name, status, data, options.format))
+        if status == 'ok':
+            return 0
+        return 1
+    finally:
+        serial_port.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+#
+# Title: USB IO Expander command table.
+#
+# Author: Rob Jansen, Copyright (c) 2024..2024, all rights reserved.
+#
+# Description: Python script with the command set of the USB IO Expander. The command functions of
+#              usb_io_expander.py and the command line interface are generated from this table. This script
+#              does not need the serial library so it can be used without opening a serial port, e.g. to
+#              check and encode commands.
+#
+
+# Command table, mirrors the COMMAND_* constants in 16f1455_usb_io_expander.jal. Each entry holds:
+#   -) The name of the generated function.
+#   -) The command token.
+#   -) The arguments as (name, width in bytes, valid values). Width 0 is a list of bytes of any length.
+#   -) The response: 'ok' for only the response, 'data' when the response is followed by data.
+#   -) A short description with the valid values, used as documentation of the generated function.
+# The valid values are the same as checked by the firmware so an invalid argument is rejected without I/O.
+# Note: SPI mode 3 is not accepted by the firmware.
+command_table = [
+    ('reset',              '!RES',  [], 'ok',
+     'Reset the USB IO Expander to its power up state.'),
+    ('ping',               '!PING', [], 'ok',
+     'Check that the USB IO Expander responds.'),
+    ('pin_bit_direction',  '!PID',  [('pin', 1, range(8)), ('direction', 1, (0, 1))], 'ok',
+     'Set the given pin (0..7) to the given direction (0 = output, 1 = input).'),
+    ('pin_bit_mode',       '!PIM',  [('pin', 1, (0, 1, 2, 3, 6)), ('mode', 1, (0, 1))], 'ok',
+     'Set the given pin (0, 1, 2, 3 or 6) to the given mode (0 = digital, 1 = analog).'),
+    ('pin_bit_pull_up',    '!PIP',  [('pin', 1, (6, 7)), ('pull_up', 1, (0, 1))], 'ok',
+     'Set the given pin (6 or 7) to the given pull-up (0 = disabled, 1 = enabled).'),
+    ('pin_bit_write',      '!PIW',  [('pin', 1, range(8)), ('value', 1, (0, 1))], 'ok',
+     'Set the given pin (0..7) to the given value (0 = low, 1 = high).'),
+    ('pin_bit_read',       '!PIR',  [('pin', 1, range(8))], 'data',
+     'Return the status of the given pin (0..7) (0 = low, 1 = high). The pin must be input.'),
+    ('pin_byte_direction', '!PYD',  [('direction', 1, range(256))], 'ok',
+     'Set the all pins (0..7) of the given bits in the given direction (0 = output, 1 = input).'),
+    ('pin_byte_write',     '!PYW',  [('value', 1, range(256))], 'ok',
+     'Set the all pins (0..7) to the given bits in the parameter value (0 = low, 1 = high).'),
+    ('pin_byte_read',      '!PYR',  [], 'data',
+     'Return the status of the given port. All pins must be input.'),
+    ('iic_init',           '!IICI', [('bus_speed', 1, (0, 1, 4, 10))], 'ok',
+     'Initialize the IIC interface with the given bus speed (0, 1, 4 or 10, 1 = 100kHz, 4 = 400 kHz).'),
+    ('iic_write',          '!IICW', [('slave_address', 1, range(256)), ('iic_write_data', 0, range(256))], 'ok',
+     'Write the given IIC data to an IIC device.'),
+    ('iic_read',           '!IICR', [('slave_address', 1, range(256)), ('nr_of_bytes', 1, range(41))], 'data',
+     'Read the given number of bytes (0..40) of IIC data from an IIC device.'),
+    ('dac_init',           '!DACI', [('channel', 1, (1, 2))], 'ok',
+     'Initialize the DAC with the given channel (1 or 2).'),
+    ('dac_enable',         '!DACE', [], 'ok',
+     'Enable the DAC.'),
+    ('dac_disable',        '!DACD', [], 'ok',
+     'Disable the DAC.'),
+    ('dac_write',          '!DACW', [('value', 1, range(32))], 'ok',
+     'Set the DAC to the given value (0..31).'),
+    ('spi_init',           '!SPII', [('mode', 1, (0, 1, 2)), ('speed', 1, (0, 1, 2))], 'ok',
+     'Initialize the SPI interface with the given mode (0, 1 or 2) and speed (0, 1 or 2).'),
+    ('spi_write',          '!SPIW', [('spi_write_data', 0, range(256))], 'ok',
+     'Write the given SPI data.'),
+    ('spi_read',           '!SPIR', [('nr_of_bytes', 1, range(41))], 'data',
+     'Read the SPI data for the given number of bytes (0..40).'),
+    ('adc_init',           '!ADCI', [('channel', 1, (3, 4, 5, 6, 7))], 'ok',
+     'Initialize the ADC with the given channel (3, 4, 5, 6, or 7).'),
+    ('adc_enable',         '!ADCE', [], 'ok',
+     'Enable the ADC.'),
+    ('adc_disable',        '!ADCD', [], 'ok',
+     'Disable the ADC.'),
+    ('adc_channel',        '!ADCC', [('channel', 1, (3, 4, 5, 6, 7))], 'ok',
+     'Select the given ADC channel (3, 4, 5, 6, or 7). ADC must be initialized.'),
+    ('adc_read',           '!ADCR', [], 'data',
+     'Get the ADC value.'),
+    ('pwm_init',           '!PWMI', [('channel', 1, (1, 2))], 'ok',
+     'Initialize the PWM with the given channel (1 or 2).'),
+    ('pwm_enable',         '!PWME', [('channel', 1, (1, 2))], 'ok',
+     'Enable the given PWM channel (1 or 2).'),
+    ('pwm_disable',        '!PWMD', [('channel', 1, (1, 2))], 'ok',
+     'Disable the given PWM channel (1 or 2).'),
+    ('pwm_frequency',      '!PWMF', [('frequency', 2, range(750, 45001))], 'ok',
+     'Set the PWM frequency (750..45000 Hz) for all channels.'),
+    ('pwm_duty_cyle',      '!PWMC', [('channel', 1, (1, 2)), ('duty_cycle', 1, range(101))], 'ok',
+     'Set the PWM duty cycle (0..100 %) for the given channel (1 or 2).'),
+]
+
+# Maximum number of characters of a command line accepted by the firmware (MAX_ASCII_BUFFER).
+max_command_length = 80
+
+# Commands that return a data line (starting with '?') after the "0" response.
+data_commands = tuple(entry[1] for entry in command_table if entry[3] == 'data')
+
+# Create the encoder of a command table entry. The encoder returns the command for the given arguments
+# (without CR/LF) or None when an argument is not valid.
+def make_encoder(token, arguments):
+    formats = []
+    valid_values = []
+    for name, width, values in arguments:
+        formats.append('{:0' + str(2 * max(1, width)) + 'X}')
+        if isinstance(values, range) and (values.step == 1):
+            valid_values.append((values.start, values.stop - 1))
+        else:
+            valid_values.append(frozenset(values))
+    # Single byte arguments are handled with one prebound format.
+    if all(width == 1 for name, width, values in arguments):
+        prebound = (token + ''.join(formats)).format
+    else:
+        prebound = None
+
+    def is_valid(value, valid):
+        if not isinstance(value, int):
+            return False
+        if isinstance(valid, tuple):
+            return valid[0] <= value <= valid[1]
+        return value in valid
+
+    def encoder(*values, **named_values):
+        values = list(values)
+        for name, width, valid in arguments[len(values):]:
+            if name in named_values:
+                values.append(named_values.pop(name))
+            elif width == 0:
+                values.append([]) # A list of bytes may be left out.
+            else:
+                return None
+        if named_values or (len(values) != len(arguments)):
+            return None
+        for argument, value, valid in zip(arguments, values, valid_values):
+            if argument[1] == 0:
+                for data in value:
+                    if not is_valid(data, valid):
+                        return None
+            elif not is_valid(value, valid):
+                return None
+        if prebound is not None:
+            command = prebound(*values)
+        else:
+            command = token
+            for argument, value, value_format in zip(arguments, values, formats):
+                if argument[1] == 0:
+                    command = command + ''.join('{:02X}'.format(data) for data in value)
+                else:
+                    command = command + value_format.format(value)
+        if len(command) > max_command_length:
+            return None
+        return command
+
+    encoder.__name__ = 'encode_' + token[1:].lower()
+    return encoder
+
+# Encoders per function name, e.g. command_encoders['pin_byte_write'](0x55) returns '!PYW55'.
+command_encoders = {}
+
+def _generate_encoders():
+    for name, token, arguments, response, description in command_table:
+        command_encoders[name] = make_encoder(token, arguments)
+
+_generate_encoders()
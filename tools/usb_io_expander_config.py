@@ -0,0 +1,320 @@
+#
+# Title: USB IO Expander configuration snapshot.
+#
+# Author: Rob Jansen, Copyright (c) 2024..2024, all rights reserved.
+#
+# Description: Python script for capturing the intended configuration of the USB IO Expander and restoring it
+#              after a reset or a new USB connection. The configuration holds the pin directions, modes,
+#              pull-ups and outputs and the IIC, SPI, ADC, DAC and PWM settings. It can be built from the
+#              setup commands of an application and saved as JSON. Restoring computes the minimal ordered
+#              list of commands needed to go from a known state, by default the state of the firmware after
+#              a reset, to the intended state and sends all these commands in one pipelined exchange.
+#              Note: The firmware changes the direction and mode of pins when initializing a peripheral. This
+#              is taken into account so these pin settings are not sent again.
+#
+
+import json
+from usb_io_expander import ser, command_exchange, command_table, command_encoders
+
+nr_of_pins = 8
+# Pins that can be set to analog (0 = digital, 1 = analog) and pins that have a pull-up.
+analog_pins = (0, 1, 2, 3, 6)
+pull_up_pins = (6, 7)
+# Pin used by each ADC channel, DAC channel and PWM channel.
+adc_channel_pins = {3: 6, 4: 0, 5: 1, 6: 2, 7: 3}
+dac_channel_pins = {1: 2, 2: 3}
+pwm_channel_pins = {1: 5, 2: 3}
+# Duty cycle set by the firmware when a PWM channel is initialized.
+pwm_init_duty_cycle = 50
+
+
+# Command table entries per token, longest token first so e.g. '!PING' is not taken for '!PI..'.
+_command_entries = sorted(command_table, key=lambda entry: len(entry[1]), reverse=True)
+
+
+# Returns the token and the list of hexadecimal arguments of the given command. Raises ValueError when an
+# argument is not hexadecimal or when the number of hexadecimal digits is odd.
+def split_command(command):
+    command = command.replace(' ', '').upper()
+    for name, token, table_arguments, response, description in _command_entries:
+        if command.startswith(token):
+            token_length = len(token)
+            break
+    else:
+        if command.startswith(('!PI', '!PY')):
+            token_length = 4
+        else:
+            token_length = 5
+    if (len(command) - token_length) % 2:
+        raise ValueError('odd number of hexadecimal digits: ' + command)
+    arguments = []
+    for index in range(token_length, len(command) - 1, 2):
+        arguments.append(int(command[index:index + 2], 16))
+    return command[:token_length], arguments
+
+
+# Returns TRUE when the given command is a command of the command table with valid arguments.
+def command_valid(command):
+    try:
+        token, arguments = split_command(command)
+    except ValueError:
+        return False
+    for name, table_token, table_arguments, response, description in _command_entries:
+        if token == table_token:
+            values = []
+            for argument_name, width, valid in table_arguments:
+                if width == 0:
+                    values.append(arguments)
+                    arguments = []
+                elif len(arguments) < width:
+                    return False
+                else:
+                    value = 0
+                    for data in arguments[:width]:
+                        value = (value << 8) | data
+                    values.append(value)
+                    arguments = arguments[width:]
+            return (not arguments) and (command_encoders[name](*values) is not None)
+    return False
+
+
+# The configuration of a USB IO Expander. A value None means not known (state) or not cared about (intent).
+class DeviceConfig:
+    def __init__(self):
+        self.direction = [None] * nr_of_pins   # 0 = output, 1 = input.
+        self.mode = [None] * nr_of_pins        # 0 = digital, 1 = analog.
+        self.pull_up = [None] * nr_of_pins     # 0 = disabled, 1 = enabled.
+        self.output = [None] * nr_of_pins      # 0 = low, 1 = high.
+        self.iic_speed = None
+        self.spi = None                        # [mode, speed]
+        self.adc_channel = None
+        self.adc_enabled = None
+        self.dac_channel = None
+        self.dac_value = None
+        self.dac_enabled = None
+        self.pwm_channels = []                 # Initialized PWM channels.
+        self.pwm_frequency = None
+        self.pwm_duty_cycle = {}               # Channel -> duty cycle.
+        self.pwm_enabled = {}                  # Channel -> True or False.
+
+    # Return a copy of this configuration.
+    def copy(self):
+        return config_from_dict(self.to_dict())
+
+    # Return the configuration as a dictionary that can be serialized.
+    def to_dict(self):
+        return {'direction': list(self.direction), 'mode': list(self.mode), 'pull_up': list(self.pull_up),
+                'output': list(self.output), 'iic_speed': self.iic_speed, 'spi': self.spi,
+                'adc_channel': self.adc_channel, 'adc_enabled': self.adc_enabled,
+                'dac_channel': self.dac_channel, 'dac_value': self.dac_value, 'dac_enabled': self.dac_enabled,
+                'pwm_channels': list(self.pwm_channels), 'pwm_frequency': self.pwm_frequency,
+                'pwm_duty_cycle': dict(self.pwm_duty_cycle), 'pwm_enabled': dict(self.pwm_enabled)}
+
+    # Return the configuration in JSON format.
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def _set_pin(self, pin, direction, mode=None):
+        self.direction[pin] = direction
+        if mode is not None:
+            self.mode[pin] = mode
+
+    # Update the configuration with the effect of the given command. Returns FALSE for an unknown command or
+    # invalid arguments, the configuration is then not changed.
+    def apply(self, command):
+        if not command_valid(command):
+            return False
+        token, arguments = split_command(command)
+        if token == '!RES':
+            reset_config = firmware_defaults()
+            self.__dict__.update(reset_config.__dict__)
+        elif token == '!PID':
+            self.direction[arguments[0]] = arguments[1]
+        elif token == '!PIM':
+            self.mode[arguments[0]] = arguments[1]
+        elif token == '!PIP':
+            self.pull_up[arguments[0]] = arguments[1]
+        elif token == '!PIW':
+            self.output[arguments[0]] = arguments[1]
+        elif token == '!PYD':
+            for pin in range(nr_of_pins):
+                self.direction[pin] = (arguments[0] >> pin) & 0x01
+        elif token == '!PYW':
+            for pin in range(nr_of_pins):
+                self.output[pin] = (arguments[0] >> pin) & 0x01
+        elif token == '!IICI':
+            self.iic_speed = arguments[0]
+            self._set_pin(0, 1, 0)
+            self._set_pin(1, 1, 0)
+        elif token == '!SPII':
+            self.spi = [arguments[0], arguments[1]]
+            self._set_pin(0, 0, 0)
+            self._set_pin(1, 1, 0)
+            self._set_pin(2, 0, 0)
+        elif token in ('!ADCI', '!ADCC'):
+            self.adc_channel = arguments[0]
+            self._set_pin(adc_channel_pins[arguments[0]], 1, 1)
+            if token == '!ADCI':
+                self.adc_enabled = False
+        elif token in ('!ADCE', '!ADCD'):
+            self.adc_enabled = (token == '!ADCE')
+        elif token == '!DACI':
+            self.dac_channel = arguments[0]
+            self.dac_enabled = False
+            self._set_pin(dac_channel_pins[arguments[0]], 0, 0)
+        elif token in ('!DACE', '!DACD'):
+            self.dac_enabled = (token == '!DACE')
+        elif token == '!DACW':
+            self.dac_value = arguments[0]
+        elif token == '!PWMI':
+            channel = arguments[0]
+            if channel not in self.pwm_channels:
+                self.pwm_channels.append(channel)
+            # The firmware sets the PWM to maximum resolution, this is not a frequency that can be set.
+            self.pwm_frequency = None
+            self.pwm_duty_cycle[channel] = pwm_init_duty_cycle
+            self.pwm_enabled[channel] = False
+            self._set_pin(pwm_channel_pins[channel], 0, 0)
+        elif token in ('!PWME', '!PWMD'):
+            self.pwm_enabled[arguments[0]] = (token == '!PWME')
+        elif token == '!PWMF':
+            self.pwm_frequency = (arguments[0] << 8) | arguments[1]
+            # The duty cycle is calculated for the frequency at the moment it is set so it must be set again.
+            for channel in self.pwm_duty_cycle:
+                self.pwm_duty_cycle[channel] = None
+        elif token == '!PWMC':
+            channel = arguments[0]
+            self.pwm_duty_cycle[channel] = arguments[1]
+            self._set_pin(pwm_channel_pins[channel], 0, 0)
+        elif token == '!PING':
+            pass
+        else:
+            return False
+        return True
+
+
+# Return a configuration from the given dictionary.
+def config_from_dict(values):
+    config = DeviceConfig()
+    for name, value in values.items():
+        if hasattr(config, name):
+            setattr(config, name, value)
+    # JSON only has string keys.
+    config.pwm_duty_cycle = {int(channel): value for channel, value in config.pwm_duty_cycle.items()}
+    config.pwm_enabled = {int(channel): value for channel, value in config.pwm_enabled.items()}
+    return config
+
+
+# Return a configuration from the given JSON text.
+def config_from_json(text):
+    return config_from_dict(json.loads(text))
+
+
+# Return the configuration built from the given list of setup commands, e.g. ['!PYD0F', '!IICI04'].
+def config_from_commands(commands):
+    config = DeviceConfig()
+    for command in commands:
+        config.apply(command)
+    return config
+
+
+# Return the configuration of the USB IO Expander after power up or a reset. All pins are digital inputs,
+# the weak pull-ups of pin 6 and 7 are enabled (power up value of WPUA) and no peripheral is initialized.
+# The value of the output latches is not known after power up.
+def firmware_defaults():
+    config = DeviceConfig()
+    config.direction = [1] * nr_of_pins
+    config.mode = [0] * nr_of_pins
+    config.pull_up = [None] * nr_of_pins
+    for pin in pull_up_pins:
+        config.pull_up[pin] = 1
+    config.adc_enabled = False
+    config.dac_value = 0
+    config.dac_enabled = False
+    return config
+
+
+# Return the commands for setting the given pin values (list of 8 values) that differ from the state.
+# When all values are given and more than one pin must change the byte command is used.
+def _pin_commands(bit_token, byte_token, wanted, current):
+    changes = []
+    for pin in range(nr_of_pins):
+        if (wanted[pin] is not None) and (wanted[pin] != current[pin]):
+            changes.append(pin)
+    if (len(changes) > 1) and (None not in wanted):
+        value = 0
+        for pin in range(nr_of_pins):
+            value = value | (wanted[pin] << pin)
+        return ['{}{:02X}'.format(byte_token, value)]
+    commands = []
+    for pin in changes:
+        commands.append('{}{:02X}{:02X}'.format(bit_token, pin, wanted[pin]))
+    return commands
+
+
+# Return the minimal ordered list of commands to get from the baseline configuration to the target
+# configuration. When no baseline is given the configuration after a reset of the firmware is used.
+def config_restore_commands(target, baseline=None):
+    if baseline is None:
+        baseline = firmware_defaults()
+    state = baseline.copy()
+    commands = []
+
+    def send(command):
+        commands.append(command)
+        state.apply(command)
+
+    # Peripherals first since they change the direction and mode of their pins.
+    if (target.iic_speed is not None) and (target.iic_speed != state.iic_speed):
+        send('!IICI{:02X}'.format(target.iic_speed))
+    if (target.spi is not None) and (target.spi != state.spi):
+        send('!SPII{:02X}{:02X}'.format(target.spi[0], target.spi[1]))
+    if target.adc_channel is not None:
+        if state.adc_channel is None:
+            send('!ADCI{:02X}'.format(target.adc_channel))
+        elif target.adc_channel != state.adc_channel:
+            send('!ADCC{:02X}'.format(target.adc_channel))
+        if (target.adc_enabled is not None) and (target.adc_enabled != state.adc_enabled):
+            send('!ADCE' if target.adc_enabled else '!ADCD')
+    if target.dac_channel is not None:
+        if target.dac_channel != state.dac_channel:
+            send('!DACI{:02X}'.format(target.dac_channel))
+        if (target.dac_value is not None) and (target.dac_value != state.dac_value):
+            send('!DACW{:02X}'.format(target.dac_value))
+        if (target.dac_enabled is not None) and (target.dac_enabled != state.dac_enabled):
+            send('!DACE' if target.dac_enabled else '!DACD')
+    # Initialize all PWM channels before setting the frequency since initialization resets the frequency.
+    for channel in target.pwm_channels:
+        if channel not in state.pwm_channels:
+            send('!PWMI{:02X}'.format(channel))
+    if (target.pwm_frequency is not None) and (target.pwm_frequency != state.pwm_frequency):
+        send('!PWMF{:04X}'.format(target.pwm_frequency))
+    for channel in target.pwm_channels:
+        duty_cycle = target.pwm_duty_cycle.get(channel)
+        if (duty_cycle is not None) and (duty_cycle != state.pwm_duty_cycle.get(channel)):
+            send('!PWMC{:02X}{:02X}'.format(channel, duty_cycle))
+        enabled = target.pwm_enabled.get(channel)
+        if (enabled is not None) and (enabled != state.pwm_enabled.get(channel)):
+            send('{}{:02X}'.format('!PWME' if enabled else '!PWMD', channel))
+    # Pins. The output latch is set before the direction to prevent glitches on pins becoming an output.
+    for pin in analog_pins:
+        if (target.mode[pin] is not None) and (target.mode[pin] != state.mode[pin]):
+            send('!PIM{:02X}{:02X}'.format(pin, target.mode[pin]))
+    for command in _pin_commands('!PIW', '!PYW', target.output, state.output):
+        send(command)
+    for command in _pin_commands('!PID', '!PYD', target.direction, state.direction):
+        send(command)
+    for pin in pull_up_pins:
+        if (target.pull_up[pin] is not None) and (target.pull_up[pin] != state.pull_up[pin]):
+            send('!PIP{:02X}{:02X}'.format(pin, target.pull_up[pin]))
+    return commands
+
+
+# Restore the given configuration in one pipelined exchange. Returns TRUE when all commands were OK
+# and the list of commands that were sent.
+def config_restore(target, serial_port=ser, baseline=None):
+    commands = config_restore_commands(target, baseline)
+    if not commands:
+        return True, commands
+    results = command_exchange(commands, serial_port)
+    return all(command_ok for command_ok, data in results), commands
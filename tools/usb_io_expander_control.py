@@ -0,0 +1,228 @@
+#
+# Title: USB IO Expander closed-loop controller.
+#
+# Author: Rob Jansen, Copyright (c) 2024..2024, all rights reserved.
+#
+# Description: Python script for simple regulation with the USB IO Expander. A sensor is read with the ADC
+#              and a heater or motor is driven with the DAC or with a PWM channel. The control loop uses
+#              a PID controller with anti-windup and runs at a configured rate against absolute deadlines.
+#              The actuator value is written as soon as it is calculated without waiting for the response.
+#              Without a rate its response is read ahead of the response of the next ADC read so a cycle
+#              costs one round trip and the loop runs as fast as the link allows. With a rate the response
+#              is read right away since the link is idle until the next deadline. The time from receiving
+#              an ADC value until the device confirmed the resulting actuator value is measured as the
+#              sensor-to-actuator latency, it is about the calculation time plus one round trip.
+#              An exception of the serial I/O does not stop the loop, it is counted as failure and kept as
+#              last error.
+#
+
+import threading
+import time
+from usb_io_expander import ser, command_encode, command_responses, serial_flush_input
+
+# Time in seconds to wait after an exception when running without a rate.
+error_retry_delay = 0.01
+
+
+# PID controller. The integrator is only updated when the output is not saturated or when the error
+# drives the output back into range (conditional integration) to prevent integrator windup.
+class PIDController:
+    def __init__(self, kp, ki=0.0, kd=0.0, setpoint=0.0, output_min=0.0, output_max=100.0):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.setpoint = setpoint
+        self.output_min = output_min
+        self.output_max = output_max
+        self.integral = 0.0
+        self.saturated = False
+        self._last_measurement = None
+
+    # Clear the integrator and the derivative history.
+    def reset(self):
+        self.integral = 0.0
+        self.saturated = False
+        self._last_measurement = None
+
+    # Return the new output for the given measurement taken dt seconds after the previous one.
+    def update(self, measurement, dt):
+        error = self.setpoint - measurement
+        # Derivative on the measurement, prevents a kick on a setpoint change.
+        if (self._last_measurement is None) or (dt <= 0):
+            derivative = 0.0
+        else:
+            derivative = -(measurement - self._last_measurement) / dt
+        self._last_measurement = measurement
+        integral = self.integral + (error * dt)
+        output = (self.kp * error) + (self.ki * integral) + (self.kd * derivative)
+        if output > self.output_max:
+            self.saturated = True
+            if error < 0:
+                self.integral = integral
+            output = self.output_max
+        elif output < self.output_min:
+            self.saturated = True
+            if error > 0:
+                self.integral = integral
+            output = self.output_min
+        else:
+            self.saturated = False
+            self.integral = integral
+        return output
+
+
+# Returns the command for setting the DAC to the given controller output (0..31).
+def dac_actuator(output):
+    return '!DACW{:02X}'.format(min(31, max(0, int(round(output)))))
+
+
+# Returns a function creating the command for setting the duty cycle of the given PWM channel (0..100).
+def pwm_actuator(channel):
+    def actuator(output):
+        return '!PWMC{:02X}{:02X}'.format(channel, min(100, max(0, int(round(output)))))
+    return actuator
+
+
+# Control loop reading the ADC and driving the actuator. The ADC and the actuator must be initialized and
+# enabled. The actuator is a function returning the command for a controller output, see dac_actuator and
+# pwm_actuator. The controller output range must match the actuator range. When rate (cycles per second)
+# is None the next cycle starts as soon as the previous cycle is done.
+class ControlLoop:
+    def __init__(self, controller, actuator, rate=None, serial_port=ser):
+        self.controller = controller
+        self.actuator = actuator
+        if rate:
+            self.period = 1.0 / rate
+        else:
+            self.period = 0.0
+        self.serial_port = serial_port
+        self.measurement = None
+        self.output = None
+        self._stop = threading.Event()
+        self._thread = None
+        # Statistics.
+        self.cycles = 0
+        self.failures = 0
+        self.last_error = None    # Last exception of the serial I/O or the controller.
+        self.overruns = 0
+        self.saturated_cycles = 0
+        self._period_sum = 0.0
+        self.max_period = 0.0
+        self._latency_sum = 0.0
+        self.latencies = 0
+        self.max_latency = 0.0
+
+    # Start the control loop in a background thread.
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    # Stop the control loop.
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    # Return the loop statistics in a dictionary.
+    def statistics(self):
+        if self.cycles > 1:
+            mean_period = self._period_sum / (self.cycles - 1)
+        else:
+            mean_period = 0.0
+        if self.latencies > 0:
+            mean_latency = self._latency_sum / self.latencies
+        else:
+            mean_latency = 0.0
+        return {'cycles': self.cycles, 'period': self.period, 'mean_period': mean_period,
+                'max_period': self.max_period, 'overruns': self.overruns, 'failures': self.failures,
+                'saturated_cycles': self.saturated_cycles, 'mean_latency': mean_latency,
+                'max_latency': self.max_latency, 'last_error': self.last_error}
+
+    # Read the response of the given actuator command and register the latency from the given sample time.
+    def _actuator_confirmed(self, command, sample_time):
+        if command_responses([command], self.serial_port)[0][0]:
+            latency = time.monotonic() - sample_time
+            self._latency_sum = self._latency_sum + latency
+            self.latencies = self.latencies + 1
+            self.max_latency = max(self.max_latency, latency)
+        else:
+            self.failures = self.failures + 1
+
+    # Run the control loop until stopped or, when given, for the given duration in seconds.
+    def run(self, duration=None):
+        start_time = time.monotonic()
+        deadline = start_time
+        last_start = None
+        last_sample_time = None
+        # Actuator command written but its response not yet read.
+        pending_actuator = None
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if (duration is not None) and (now - start_time >= duration):
+                break
+            if deadline > now:
+                if self._stop.wait(deadline - now):
+                    break
+            cycle_start = time.monotonic()
+            if last_start is not None:
+                cycle_period = cycle_start - last_start
+                self._period_sum = self._period_sum + cycle_period
+                self.max_period = max(self.max_period, cycle_period)
+            last_start = cycle_start
+            try:
+                # Read the ADC, the response of an actuator command still in flight comes first.
+                self.serial_port.write(command_encode(['!ADCR']))
+                if pending_actuator is not None:
+                    actuator_command = pending_actuator
+                    pending_actuator = None
+                    self._actuator_confirmed(actuator_command, last_sample_time)
+                command_ok, adc_data = command_responses(['!ADCR'], self.serial_port)[0]
+                sample_time = time.monotonic()
+                self.cycles = self.cycles + 1
+                if command_ok and (len(adc_data) == 2):
+                    self.measurement = (adc_data[0] * 256) + adc_data[1]
+                    if last_sample_time is None:
+                        dt = 0.0
+                    else:
+                        dt = sample_time - last_sample_time
+                    self.output = self.controller.update(self.measurement, dt)
+                    if self.controller.saturated:
+                        self.saturated_cycles = self.saturated_cycles + 1
+                    # Write the actuator value right away without waiting for the response.
+                    actuator_command = self.actuator(self.output)
+                    self.serial_port.write(command_encode([actuator_command]))
+                    last_sample_time = sample_time
+                    if self.period > 0:
+                        # The link is idle until the next deadline, read the response now.
+                        self._actuator_confirmed(actuator_command, sample_time)
+                    else:
+                        pending_actuator = actuator_command
+                else:
+                    self.failures = self.failures + 1
+            except Exception as error:
+                # Serial I/O or controller failed. Responses may be left behind, remove them.
+                self.failures = self.failures + 1
+                self.last_error = error
+                pending_actuator = None
+                try:
+                    serial_flush_input(self.serial_port)
+                except Exception:
+                    pass
+                if (self.period == 0) and self._stop.wait(error_retry_delay):
+                    break
+            # Next deadline, skip deadlines that already passed.
+            if self.period > 0:
+                deadline = deadline + self.period
+                now = time.monotonic()
+                while deadline < now:
+                    deadline = deadline + self.period
+                    self.overruns = self.overruns + 1
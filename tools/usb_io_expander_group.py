@@ -0,0 +1,168 @@
+#
+# Title: USB IO Expander device group.
+#
+# Author: Rob Jansen, Copyright (c) 2024..2024, all rights reserved.
+#
+# Description: Python script for operating a group of USB IO Expanders in parallel. Each USB IO Expander
+#              has its own serial port and gets its commands from its own worker thread so the latency
+#              of the group is about the latency of one device instead of the sum of all devices.
+#              Commands can be prepared on all devices first and then fired on all devices at the same
+#              moment to keep the time skew between the first and the last device as small as possible.
+#              A single command is staged on the device by writing it without its line terminator, the
+#              USB IO Expander only executes a line when CR or LF is received. Firing then only sends one
+#              CR per device. More commands per device are sent completely when fired.
+#
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from usb_io_expander import serial_open, serial_flush_input, command_encode, command_responses, command_encoders
+
+
+# The result of one group operation.
+#   -) results: per comport the list of (command_ok, data) of each command.
+#   -) errors: per comport the exception when the device could not be handled.
+#   -) first_action, last_action: time (time.perf_counter) the first and last device got its commands.
+class GroupResult:
+    def __init__(self):
+        self.results = {}
+        self.errors = {}
+        self.first_action = 0.0
+        self.last_action = 0.0
+
+    # Time in seconds between the first and the last device acting.
+    def skew(self):
+        return self.last_action - self.first_action
+
+    # Returns TRUE when all commands on all devices were OK.
+    def all_ok(self):
+        if self.errors:
+            return False
+        for results in self.results.values():
+            for command_ok, data in results:
+                if not command_ok:
+                    return False
+        return True
+
+
+# A group of USB IO Expanders, one per comport.
+class DeviceGroup:
+    def __init__(self, comports):
+        self.ports = {}
+        self.open_errors = []
+        for comport in comports:
+            serial_port = serial_open(comport)
+            if serial_port is None:
+                self.open_errors.append(comport)
+            else:
+                self.ports[comport] = serial_port
+        # One worker per device, all workers must be able to wait for the start at the same time.
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(self.ports)))
+        self._prepared = {}
+        self._prepare_errors = {}
+        self._staged = False
+
+    # Close all serial ports and stop the worker threads.
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for serial_port in self.ports.values():
+            try:
+                serial_port.close()
+            except:
+                pass
+        self.ports = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Prepare the given commands on all devices. Commands is either one list of commands for all
+    # devices or a dictionary with a list of commands per comport. A single command is staged on the
+    # device, nothing is executed until fired. Raises RuntimeError when staged commands were not fired
+    # since the device cannot remove them.
+    def prepare(self, commands):
+        if self._staged:
+            raise RuntimeError('staged commands must be fired first')
+        self._prepared = {}
+        self._prepare_errors = {}
+        for comport, serial_port in self.ports.items():
+            if isinstance(commands, dict):
+                device_commands = commands.get(comport, [])
+            else:
+                device_commands = commands
+            if not device_commands:
+                continue
+            try:
+                # Remove old responses so they cannot be mistaken for the new ones.
+                serial_flush_input(serial_port)
+                if len(device_commands) == 1:
+                    self._staged = True
+                    serial_port.write(device_commands[0].encode())
+                    self._prepared[comport] = (device_commands, b'\r')
+                else:
+                    self._prepared[comport] = (device_commands, command_encode(device_commands))
+            except Exception as error:
+                self._prepare_errors[comport] = error
+
+    # Send the prepared commands to all devices at the same time and gather the results.
+    def fire(self):
+        prepared = self._prepared
+        self._prepared = {}
+        self._staged = False
+        group_result = GroupResult()
+        group_result.errors.update(self._prepare_errors)
+        self._prepare_errors = {}
+        if not prepared:
+            return group_result
+        action_times = {}
+        start = threading.Barrier(len(prepared))
+
+        def run_device(comport):
+            device_commands, encoded = prepared[comport]
+            serial_port = self.ports[comport]
+            try:
+                start.wait()
+            except threading.BrokenBarrierError:
+                pass
+            action_times[comport] = time.perf_counter()
+            serial_port.write(encoded)
+            return command_responses(device_commands, serial_port)
+
+        futures = {}
+        for comport in prepared:
+            futures[comport] = self._executor.submit(run_device, comport)
+        for comport, future in futures.items():
+            try:
+                group_result.results[comport] = future.result()
+            except Exception as error:
+                group_result.errors[comport] = error
+        if action_times:
+            group_result.first_action = min(action_times.values())
+            group_result.last_action = max(action_times.values())
+        return group_result
+
+    # Prepare and fire the given commands in one go.
+    def execute(self, commands):
+        self.prepare(commands)
+        return self.fire()
+
+    # Returns a result with the given error for all devices, nothing is sent.
+    def _invalid_result(self, error):
+        group_result = GroupResult()
+        for comport in self.ports:
+            group_result.errors[comport] = error
+        return group_result
+
+    # Set the all pins (0..7) of all devices to the given bits in the parameter value (0..255).
+    # An invalid value is not sent and reported as error for all devices.
+    def pin_byte_write(self, value):
+        command = command_encoders['pin_byte_write'](value)
+        if command is None:
+            return self._invalid_result(ValueError('invalid value: {}'.format(value)))
+        return self.execute([command])
+
+    # Read the ADC of all devices. The ADC of each device must be initialized and enabled.
+    def adc_read(self):
+        return self.execute(['!ADCR'])
@@ -0,0 +1,91 @@
+#
+# Title: USB IO Expander IIC bus scanner.
+#
+# Author: Rob Jansen, Copyright (c) 2024..2024, all rights reserved.
+#
+# Description: Python script for finding the devices on the IIC bus. All 7-bit addresses are probed with a
+#              write of only the slave address. A device that acknowledges its address returns OK. All
+#              probes are sent in one go so the scan takes one pipelined exchange instead of a round
+#              trip per address. The inventory is cached per serial port until the IIC bus is initialized
+#              again or the USB IO Expander is reset.
+#              Note: As in the rest of the library, addresses are given in 8-bit format (7-bit address
+#              shifted one position to the left), e.g. 0x40 for an MCP23008 with A0, A1 and A2 at GND.
+#
+
+import usb_io_expander
+from usb_io_expander import ser, command_exchange
+
+# 7-bit addresses 0x00..0x07 and 0x78..0x7F are reserved by the IIC specification.
+first_iic_address = 0x08
+last_iic_address = 0x77
+
+# Cached inventories per serial port: (iic_bus_generation, identified, inventory). Identified is TRUE when
+# the identification hooks were run for the inventory.
+_inventories = {}
+
+# Identification hooks, a list of (name, first_address, last_address, identify function). The identify
+# function is called with the serial port and the 8-bit address and returns TRUE when the device is found.
+iic_identify_hooks = []
+
+
+# Register a function that identifies a known part within the given 8-bit address range.
+def iic_register_identify(name, first_address, last_address, identify):
+    iic_identify_hooks.append((name, first_address, last_address, identify))
+
+
+# MCP23008: IOCON register (0x05) bits 7, 6 and 0 are not implemented and always read as 0.
+def identify_mcp23008(serial_port, address):
+    results = command_exchange(['!IICW{:02X}05'.format(address), '!IICR{:02X}01'.format(address)], serial_port)
+    command_ok, iic_data = results[1]
+    return results[0][0] and command_ok and (len(iic_data) == 1) and ((iic_data[0] & 0xC1) == 0)
+
+
+# 24Cxx EEPROM: Only a current address read is done, this does not tell the type or size of the EEPROM.
+# Writing a sub address to find out could overwrite data since EEPROMs use a byte or a word sub address.
+def identify_24cxx_eeprom(serial_port, address):
+    command_ok, iic_data = command_exchange(['!IICR{:02X}01'.format(address)], serial_port)[0]
+    return command_ok and (len(iic_data) == 1)
+
+
+iic_register_identify("MCP23008", 0x40, 0x4E, identify_mcp23008)
+iic_register_identify("24Cxx EEPROM", 0xA0, 0xAE, identify_24cxx_eeprom)
+
+
+# Remove the cached inventory of the given serial port or all ports when none given.
+def iic_scan_invalidate(serial_port=None):
+    if serial_port is None:
+        _inventories.clear()
+    else:
+        _inventories.pop(id(serial_port), None)
+
+
+# Scan the IIC bus for devices. IIC must be initialized. Returns TRUE and the inventory, a dictionary with
+# the 8-bit address of each device found and the name of the identified part (None when not identified).
+# A cached inventory is returned when available unless refresh is TRUE.
+def iic_scan(serial_port=ser, identify=False, refresh=False):
+    cached = _inventories.get(id(serial_port))
+    if cached is not None and not refresh and cached[0] == usb_io_expander.iic_bus_generation:
+        identified, inventory = cached[1], cached[2]
+        if identified or not identify:
+            return True, dict(inventory)
+    addresses = []
+    commands = []
+    for address in range(first_iic_address, last_iic_address + 1):
+        addresses.append(address << 1)
+        commands.append('!IICW{:02X}'.format(address << 1))
+    try:
+        results = command_exchange(commands, serial_port)
+    except Exception:
+        return False, {}
+    inventory = {}
+    for address, (command_ok, data) in zip(addresses, results):
+        if command_ok:
+            inventory[address] = None
+    if identify:
+        for address in inventory:
+            for name, first_address, last_address, identify_part in iic_identify_hooks:
+                if (first_address <= address <= last_address) and identify_part(serial_port, address):
+                    inventory[address] = name
+                    break
+    _inventories[id(serial_port)] = (usb_io_expander.iic_bus_generation, identify, inventory)
+    return True, dict(inventory)
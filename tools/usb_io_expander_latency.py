@@ -0,0 +1,141 @@
+#
+# Title: USB IO Expander low latency serial settings for Linux.
+#
+# Author: Rob Jansen, Copyright (c) 2024..2024, all rights reserved.
+#
+# Description: Python script for reducing the round trip latency of the serial connection on Linux hosts. This is
+#              an opt-in mode that applies the following settings when available:
+#              -) The ASYNC_LOW_LATENCY flag of the serial driver (TIOCSSERIAL), not all drivers use it.
+#              -) Optionally the CPU affinity and the real-time priority (SCHED_FIFO) of the calling thread.
+#                 A real-time priority normally requires root privileges or CAP_SYS_NICE.
+#              The round trip latency is measured with the ping command before and after applying the
+#              settings. Run this script to get a before/after latency report.
+#              Note: The terminal settings VMIN and VTIME are not used since pyserial opens the port non
+#                    blocking, waits for data itself and sets these again when it reconfigures the port.
+#
+
+import os
+import struct
+import sys
+from usb_io_expander import ser, command_exchange, default_comport, get_default_comport, serial_init, serial_end
+
+# From linux/serial.h and asm-generic/ioctls.h.
+TIOCGSERIAL = 0x541E
+TIOCSSERIAL = 0x541F
+ASYNC_LOW_LATENCY = 1 << 13
+serial_struct_size = 72   # Large enough for struct serial_struct.
+serial_flags_offset = 16  # Offset of the flags field after type, line, port and irq.
+
+
+# Set the ASYNC_LOW_LATENCY flag of the serial driver. Returns TRUE when successful.
+def _set_driver_low_latency(fd):
+    import fcntl
+    buffer = bytearray(serial_struct_size)
+    fcntl.ioctl(fd, TIOCGSERIAL, buffer)
+    flags = struct.unpack_from('i', buffer, serial_flags_offset)[0]
+    struct.pack_into('i', buffer, serial_flags_offset, flags | ASYNC_LOW_LATENCY)
+    fcntl.ioctl(fd, TIOCSSERIAL, buffer)
+    fcntl.ioctl(fd, TIOCGSERIAL, buffer)
+    return (struct.unpack_from('i', buffer, serial_flags_offset)[0] & ASYNC_LOW_LATENCY) != 0
+
+
+# Apply the low latency settings to the given open serial port. When cpu is given the calling thread is
+# bound to that CPU, when priority is given the calling thread gets that SCHED_FIFO priority (1..99).
+# Returns a dictionary with per setting TRUE when applied, FALSE when failed and None when not available.
+# Note: Apply the settings again after changing the serial port settings since pyserial reconfigures the port.
+def serial_low_latency(serial_port=ser, cpu=None, priority=None):
+    applied = {'driver_low_latency': None, 'cpu_affinity': None, 'priority': None}
+    if not sys.platform.startswith('linux'):
+        return applied
+    try:
+        fd = serial_port.fileno()
+    except Exception:
+        fd = None
+    if fd is not None:
+        try:
+            applied['driver_low_latency'] = _set_driver_low_latency(fd)
+        except OSError:
+            applied['driver_low_latency'] = False
+    if cpu is not None:
+        try:
+            # Pid 0 is the calling thread.
+            os.sched_setaffinity(0, {cpu})
+            applied['cpu_affinity'] = True
+        except (OSError, AttributeError):
+            applied['cpu_affinity'] = False
+    if priority is not None:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+            applied['priority'] = True
+        except (OSError, AttributeError):
+            applied['priority'] = False
+    return applied
+
+
+# Measure the round trip latency with the given number of ping commands. Returns a dictionary with the
+# minimum, mean, median, 99th percentile and maximum in seconds and the number of failed pings.
+# Raises ValueError when count is less than 1.
+def measure_round_trip(serial_port=ser, count=200):
+    import time
+    if count < 1:
+        raise ValueError('count must be at least 1')
+    round_trips = []
+    failures = 0
+    for index in range(count):
+        start = time.perf_counter()
+        command_ok, data = command_exchange(['!PING'], serial_port)[0]
+        round_trips.append(time.perf_counter() - start)
+        if not command_ok:
+            failures = failures + 1
+    round_trips.sort()
+    return {'min': round_trips[0], 'mean': sum(round_trips) / count, 'median': round_trips[count // 2],
+            'p99': round_trips[min(count - 1, (count * 99) // 100)], 'max': round_trips[-1], 'failures': failures}
+
+
+# Measure the latency, apply the low latency settings and measure again.
+# Returns the latency before, the applied settings and the latency after.
+def latency_report(serial_port=ser, count=200, cpu=None, priority=None):
+    before = measure_round_trip(serial_port, count)
+    applied = serial_low_latency(serial_port, cpu, priority)
+    after = measure_round_trip(serial_port, count)
+    return before, applied, after
+
+
+# Print the given latency report.
+def print_latency_report(before, applied, after):
+    print("Applied settings:")
+    for name, value in applied.items():
+        if value is None:
+            status = "not available"
+        elif value:
+            status = "applied"
+        else:
+            status = "failed"
+        print("  {:20s} {}".format(name, status))
+    print("Round trip latency (ms)   before     after")
+    for name in ('min', 'mean', 'median', 'p99', 'max'):
+        print("  {:20s} {:9.3f} {:9.3f}".format(name, before[name] * 1000, after[name] * 1000))
+    print("  {:20s} {:9d} {:9d}".format('failures', before['failures'], after['failures']))
+
+
+if __name__ == "__main__":
+    # Main program starts here.
+    comport = get_default_comport()
+    print("Script for measuring the round trip latency of the USB IO Expander.")
+
+    # If the argument count is 1 we assume the default port.
+    if len(sys.argv) == 2:
+        comport = sys.argv[1]
+
+    if comport == default_comport:
+        print("An optional argument <comport> can be given for the serial connection to be used.")
+        print("Currently using serial connection:", comport)
+    else:
+        print("Using serial connection:", comport)
+
+    if not serial_init(comport):
+        sys.exit(1)
+
+    print_latency_report(*latency_report())
+    serial_end()
+    sys.exit(0)
@@ -0,0 +1,145 @@
+#
+# Title: USB IO Expander output pattern generator.
+#
+# Author: Rob Jansen, Copyright (c) 2024..2024, all rights reserved.
+#
+# Description: Python script for generating timed patterns on the 8 pins of the USB IO Expander. A pattern is
+#              given as a list of (time, port value) or as waveforms per pin, a list of (time, level) for each
+#              pin. Changes of pins at the same time are merged into one pin byte write using a shadow of the
+#              output latch so each step costs one command and steps that do not change the port are dropped.
+#              All commands are encoded before the pattern starts and are written at their deadline without
+#              waiting for the response of the previous command (pipelining). The achieved edge rate and the
+#              timing error are reported.
+#              Note: The pins used must be set to output before the pattern is started.
+#
+
+import time
+from usb_io_expander import ser, command_encode, command_responses
+
+
+# Return the port values of the given waveforms. Waveforms is a dictionary with per pin a list of
+# (time, level). Changes within resolution seconds of each other are merged into one port value.
+# The port starts with the given initial value, pins without a waveform keep their level of this value.
+# Returns a list of (time, port value). See also PatternGenerator.pattern_from_waveforms.
+def pattern_from_waveforms(waveforms, initial=0x00, resolution=0.0):
+    events = []
+    for pin, waveform in waveforms.items():
+        for event_time, level in waveform:
+            events.append((event_time, pin, level))
+    events.sort(key=lambda event: event[0])
+    pattern = []
+    value = initial
+    step_time = None
+    for event_time, pin, level in events:
+        if (step_time is not None) and (event_time - step_time > resolution):
+            pattern.append((step_time, value))
+            step_time = None
+        if step_time is None:
+            step_time = event_time
+        if level:
+            value = value | (1 << pin)
+        else:
+            value = value & ~(1 << pin)
+    if step_time is not None:
+        pattern.append((step_time, value))
+    return pattern
+
+
+# Returns the number of pins that change between the given port values.
+def count_edges(old_value, new_value):
+    return bin((old_value ^ new_value) & 0xFF).count('1')
+
+
+class PatternGenerator:
+    # The shadow is the current value of the output latch, None when not known. At most max_outstanding
+    # commands are sent without having received their response.
+    def __init__(self, serial_port=ser, shadow=None, max_outstanding=16):
+        self.serial_port = serial_port
+        self.shadow = shadow
+        self.max_outstanding = max_outstanding
+        self.report = {}
+
+    # Return the port values of the given waveforms merged against the shadow of the output latch so pins
+    # without a waveform keep their level, see pattern_from_waveforms. When the shadow is not known the
+    # initial value of the port must be given, otherwise ValueError is raised.
+    def pattern_from_waveforms(self, waveforms, initial=None, resolution=0.0):
+        if initial is None:
+            initial = self.shadow
+        if initial is None:
+            raise ValueError('output latch not known, give the initial value')
+        return pattern_from_waveforms(waveforms, initial, resolution)
+
+    # Return the steps of the given pattern, a list of (time, port value, command, edges). Steps that do
+    # not change the port are removed. The edges of the first step are None when the shadow is not known.
+    def prepare(self, pattern):
+        steps = []
+        shadow = self.shadow
+        for step_time, value in sorted(pattern, key=lambda step: step[0]):
+            value = value & 0xFF
+            if value == shadow:
+                continue
+            if shadow is None:
+                edges = None
+            else:
+                edges = count_edges(shadow, value)
+            command = '!PYW{:02X}'.format(value)
+            steps.append((step_time, value, command_encode([command]), edges))
+            shadow = value
+        return steps
+
+    # Play the given pattern, a list of (time, port value) with the time in seconds relative to the start.
+    # The pattern starts start_delay seconds after calling this function. Returns a report with the
+    # achieved edge rate and the timing error. When the shadow is not known the edges of the first write
+    # are not known, this write is not counted in the edges and reported as unknown_start.
+    def play(self, pattern, start_delay=0.0):
+        steps = self.prepare(pattern)
+        outstanding = []
+        failures = 0
+        edges = 0
+        unknown_start = False
+        errors = []
+        start = time.perf_counter() + start_delay
+        first_write = None
+        last_write = None
+        for step_time, value, encoded, step_edges in steps:
+            deadline = start + step_time
+            # Sleep until just before the deadline and wait the last part actively for accurate timing.
+            delay = deadline - time.perf_counter()
+            if delay > 0.002:
+                time.sleep(delay - 0.002)
+            while time.perf_counter() < deadline:
+                pass
+            if len(outstanding) >= self.max_outstanding:
+                if not command_responses([outstanding.pop(0)], self.serial_port)[0][0]:
+                    failures = failures + 1
+            write_time = time.perf_counter()
+            self.serial_port.write(encoded)
+            outstanding.append('!PYW')
+            errors.append(write_time - deadline)
+            if first_write is None:
+                first_write = write_time
+            last_write = write_time
+            if step_edges is None:
+                unknown_start = True
+            else:
+                edges = edges + step_edges
+            self.shadow = value
+        for result in command_responses(outstanding, self.serial_port):
+            if not result[0]:
+                failures = failures + 1
+        if errors:
+            duration = last_write - first_write
+        else:
+            duration = 0.0
+        if duration > 0:
+            edge_rate = edges / duration
+        else:
+            edge_rate = 0.0
+        self.report = {'steps': len(steps), 'edges': edges, 'duration': duration, 'edge_rate': edge_rate,
+                       'mean_error': (sum(errors) / len(errors)) if errors else 0.0,
+                       'max_error': max(errors) if errors else 0.0, 'failures': failures,
+                       'unknown_start': unknown_start}
+        if failures:
+            # Not known which values were not applied.
+            self.shadow = None
+        return self.report
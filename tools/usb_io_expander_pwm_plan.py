@@ -0,0 +1,192 @@
+#
+# Title: USB IO Expander PWM frequency and duty cycle planner.
+#
+# Author: Rob Jansen, Copyright (c) 2024..2024, all rights reserved.
+#
+# Description: Python script modelling how the firmware sets the PWM of the PIC16F1455 running at 48 MHz. The
+#              firmware uses the jallib pwm libraries which set Timer2 as follows:
+#              -) Frequency: the number of instruction cycles (48 MHz / 4) per period is divided by the
+#                 smallest Timer2 prescaler (1, 4, 16 or 64) that makes it fit in PR2 + 1 <= 256.
+#              -) Duty cycle in percent: duty = percent * ((PR2 + 1) / 4) / 25 in whole numbers, 0% is 0 and
+#                 100% is PR2. The duty register is this value shifted left 2 bits, 10 bits in total.
+#              -) The duty register is calculated with the PR2 value at the moment the duty cycle is set. A new
+#                 frequency does not change the duty register so the duty cycle must be set again.
+#              -) Initializing a channel sets the duty cycle to 50% and then the maximum resolution (PR2 = 255,
+#                 prescaler 1) for both channels.
+#              With this model the achieved frequency and duty cycle are reported and sweeps are planned with
+#              only the commands that change a register, many requested frequencies map to the same setting.
+#              Run this script for the number of commands of the sweep of Test_PWM.py with and without planning.
+#
+
+import math
+import sys
+from usb_io_expander_commands import command_encoders
+
+target_clock = 48_000_000
+instruction_clock = target_clock // 4
+minimum_frequency = 750
+maximum_frequency = 45_000
+timer2_prescalers = (1, 4, 16, 64)
+init_duty_cycle = 50
+
+
+# Returns the Timer2 setting for the given frequency as (prescaler, PR2 + 1).
+def pwm_timer_setting(frequency):
+    divider = instruction_clock // frequency
+    for prescaler in timer2_prescalers:
+        if divider <= 256 * prescaler:
+            return prescaler, divider // prescaler
+    return timer2_prescalers[-1], 256
+
+
+# Returns the frequency in Hz achieved with the given Timer2 setting.
+def pwm_achieved_frequency(prescaler, period):
+    return instruction_clock / (prescaler * period)
+
+
+# Returns the 10-bit duty register for the given duty cycle (0..100 %) and PR2 + 1.
+def pwm_duty_register(duty_cycle, period):
+    if duty_cycle == 0:
+        duty = 0
+    elif duty_cycle >= 100:
+        duty = period - 1
+    else:
+        duty = (duty_cycle * (period // 4)) // 25
+    return duty << 2
+
+
+# Returns the duty cycle in percent achieved with the given duty register and PR2 + 1.
+def pwm_achieved_duty_cycle(duty_register, period):
+    return min(100.0, (100.0 * duty_register) / (4 * period))
+
+
+# Returns a dictionary describing the PWM setting for the given frequency: the Timer2 prescaler, the PR2 value,
+# the achieved frequency, the number of duty register steps per period and the resolution in bits.
+def pwm_frequency_setting(frequency):
+    prescaler, period = pwm_timer_setting(frequency)
+    return {'frequency': frequency, 'prescaler': prescaler, 'pr2': period - 1,
+            'achieved_frequency': pwm_achieved_frequency(prescaler, period),
+            'duty_steps': 4 * period, 'resolution_bits': math.log2(4 * period)}
+
+
+# Returns the requested frequencies that give a different Timer2 setting, the first frequency of each setting
+# is kept. Frequencies outside the range of the firmware are removed.
+def pwm_unique_frequencies(frequencies):
+    unique = []
+    settings = set()
+    for frequency in frequencies:
+        if not (minimum_frequency <= frequency <= maximum_frequency):
+            continue
+        setting = pwm_timer_setting(frequency)
+        if setting not in settings:
+            settings.add(setting)
+            unique.append(frequency)
+    return unique
+
+
+# Returns TRUE when the frequency and duty cycles of the given point are accepted by the firmware.
+def pwm_point_valid(frequency, duty_cycles):
+    if command_encoders['pwm_frequency'](frequency) is None:
+        return False
+    for channel, duty_cycle in duty_cycles.items():
+        if command_encoders['pwm_duty_cyle'](channel, duty_cycle) is None:
+            return False
+    return True
+
+
+# Plan a sweep. Points is a list of (frequency, {channel: duty cycle}) in the order they are wanted. The
+# channels must be initialized; when initialized is TRUE the state right after initialization is assumed,
+# otherwise the first point sets everything. Returns per point the commands needed (empty when nothing
+# changes), the achieved frequency and the achieved duty cycle per channel. Invalid points have no commands
+# and are marked as not valid.
+# Note: The pin of a channel is only made output by initialization and by a duty cycle command so do not
+#       change the direction of that pin during the sweep.
+def pwm_plan_sweep(points, channels=(1, 2), initialized=True):
+    if initialized:
+        current_setting = (1, 256)
+        current_duty = {}
+        for channel in channels:
+            current_duty[channel] = pwm_duty_register(init_duty_cycle, 256)
+    else:
+        current_setting = None
+        current_duty = {}
+    plan = []
+    for frequency, duty_cycles in points:
+        if not pwm_point_valid(frequency, duty_cycles):
+            plan.append({'frequency': frequency, 'valid': False, 'commands': [],
+                         'achieved_frequency': None, 'achieved_duty_cycle': {}})
+            continue
+        commands = []
+        setting = pwm_timer_setting(frequency)
+        if setting != current_setting:
+            commands.append(command_encoders['pwm_frequency'](frequency))
+            current_setting = setting
+        achieved_duty = {}
+        for channel in channels:
+            duty_cycle = duty_cycles.get(channel)
+            if duty_cycle is not None:
+                duty_register = pwm_duty_register(duty_cycle, setting[1])
+                if duty_register != current_duty.get(channel):
+                    commands.append(command_encoders['pwm_duty_cyle'](channel, duty_cycle))
+                    current_duty[channel] = duty_register
+            if current_duty.get(channel) is not None:
+                achieved_duty[channel] = pwm_achieved_duty_cycle(current_duty[channel], setting[1])
+        plan.append({'frequency': frequency, 'valid': True, 'commands': commands,
+                     'achieved_frequency': pwm_achieved_frequency(setting[0], setting[1]),
+                     'achieved_duty_cycle': achieved_duty})
+    return plan
+
+
+# Returns all commands of the given plan in order.
+def pwm_plan_commands(plan):
+    commands = []
+    for point in plan:
+        commands.extend(point['commands'])
+    return commands
+
+
+# Send the commands of the given plan, per point in one pipelined exchange. When a dwell time in seconds is
+# given, wait that time after each point. Returns TRUE when all commands were accepted.
+def pwm_run_plan(plan, serial_port=None, dwell=None):
+    import time
+    from usb_io_expander import ser, command_exchange
+    if serial_port is None:
+        serial_port = ser
+    for point in plan:
+        if point['commands']:
+            results = command_exchange(point['commands'], serial_port)
+            if not all(command_ok for command_ok, data in results):
+                return False
+        if dwell is not None:
+            time.sleep(dwell)
+    return True
+
+
+# Returns the points of the sweep of Test_PWM.py for the given frequencies: per frequency the duty cycle goes
+# up from 0 to 100% for channel 1 and down for channel 2.
+def pwm_test_sweep_points(frequencies):
+    points = []
+    for frequency in frequencies:
+        for duty_cycle in range(101):
+            points.append((frequency, {1: duty_cycle, 2: 100 - duty_cycle}))
+    return points
+
+
+if __name__ == "__main__":
+    # Main program starts here.
+    print("Script for planning the PWM sweep of Test_PWM.py.")
+    frequencies = list(range(minimum_frequency, maximum_frequency + 1, 250))
+    points = pwm_test_sweep_points(frequencies)
+    plan = pwm_plan_sweep(points)
+    planned = len(pwm_plan_commands(plan))
+    # Test_PWM.py sends a frequency command and two duty cycle commands per duty cycle step.
+    unplanned = len(frequencies) * (1 + 2 * 101)
+    print("Frequencies requested:", len(frequencies), "different settings:", len(pwm_unique_frequencies(frequencies)))
+    print("Commands without planning:", unplanned, "with planning:", planned)
+    print("Frequency   Achieved  Prescaler  PR2  Resolution (bits)")
+    for frequency in (minimum_frequency, 1000, 5000, 10_000, 20_000, 30_000, maximum_frequency):
+        setting = pwm_frequency_setting(frequency)
+        print("{:9d} {:10.1f} {:10d} {:4d} {:18.2f}".format(frequency, setting['achieved_frequency'],
+                                                             setting['prescaler'], setting['pr2'],
+                                                             setting['resolution_bits']))
+    sys.exit(0)
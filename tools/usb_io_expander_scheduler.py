@@ -0,0 +1,242 @@
+#
+# Title: USB IO Expander periodic task scheduler.
+#
+# Author: Rob Jansen, Copyright (c) 2024..2024, all rights reserved.
+#
+# Description: Python script for running periodic jobs on the USB IO Expander, e.g. reading the ADC or
+#              polling the pins. Each job has a list of commands that is executed at absolute deadlines on
+#              the monotonic clock so the period does not drift with the duration of the I/O. Jobs that are
+#              due at the same time are packed into one pipelined exchange. When a job cannot keep up, the
+#              missed deadlines are skipped and counted as overrun. Period, jitter and overrun statistics
+#              are kept per job. An exception of the serial I/O or of a callback does not stop the
+#              scheduler, it is counted as failure of the jobs involved and kept as last error.
+#              There is a thread based scheduler and an asyncio based scheduler.
+#
+
+import asyncio
+import math
+import threading
+import time
+from usb_io_expander import ser, command_exchange
+
+
+class PeriodicJob:
+    # The callback is called with the job and the list of (command_ok, data) of each command.
+    def __init__(self, name, period, commands, callback=None):
+        self.name = name
+        self.period = period
+        self.commands = list(commands)
+        self.callback = callback
+        self.deadline = 0.0
+        # Statistics.
+        self.runs = 0
+        self.overruns = 0          # Number of deadlines that were skipped.
+        self.failures = 0          # Number of runs in which a command was not OK or an exception occurred.
+        self.last_error = None     # Last exception of the serial I/O or the callback.
+        self.last_start = None
+        self._interval_sum = 0.0
+        self._lateness_sum = 0.0
+        self._lateness_square_sum = 0.0
+        self.max_lateness = 0.0
+
+    # Register a run that started at the given time.
+    def _started(self, start):
+        lateness = start - self.deadline
+        if self.last_start is not None:
+            self._interval_sum = self._interval_sum + (start - self.last_start)
+        self.last_start = start
+        self.runs = self.runs + 1
+        self._lateness_sum = self._lateness_sum + lateness
+        self._lateness_square_sum = self._lateness_square_sum + (lateness * lateness)
+        self.max_lateness = max(self.max_lateness, lateness)
+
+    # Set the next deadline. Deadlines that already passed are skipped and counted as overrun.
+    def _advance(self, now):
+        self.deadline = self.deadline + self.period
+        if now > self.deadline:
+            missed = math.floor((now - self.deadline) / self.period) + 1
+            self.overruns = self.overruns + missed
+            self.deadline = self.deadline + (missed * self.period)
+
+    # Return the statistics in a dictionary. Jitter is the standard deviation of the start time
+    # relative to the deadline.
+    def statistics(self):
+        if self.runs > 1:
+            mean_period = self._interval_sum / (self.runs - 1)
+        else:
+            mean_period = 0.0
+        if self.runs > 0:
+            mean_lateness = self._lateness_sum / self.runs
+            variance = max(0.0, (self._lateness_square_sum / self.runs) - (mean_lateness * mean_lateness))
+        else:
+            mean_lateness = 0.0
+            variance = 0.0
+        return {'period': self.period, 'runs': self.runs, 'mean_period': mean_period,
+                'mean_lateness': mean_lateness, 'max_lateness': self.max_lateness,
+                'jitter': math.sqrt(variance), 'overruns': self.overruns, 'failures': self.failures,
+                'last_error': self.last_error}
+
+
+# Common part of the thread based and the asyncio based scheduler.
+class _SchedulerBase:
+    # Jobs with deadlines within batch_window seconds of each other are packed into one exchange.
+    def __init__(self, serial_port=ser, batch_window=0.001):
+        self.serial_port = serial_port
+        self.batch_window = batch_window
+        self.jobs = []
+        self.exchanges = 0
+        self.errors = 0            # Number of exceptions of the serial I/O or the callbacks.
+        self.last_error = None
+
+    # Add a job running the given commands every period seconds. Returns the job.
+    def add_job(self, name, period, commands, callback=None):
+        job = PeriodicJob(name, period, commands, callback)
+        job.deadline = time.monotonic()
+        self.jobs.append(job)
+        return job
+
+    # Remove the given job.
+    def remove_job(self, job):
+        self.jobs.remove(job)
+
+    # Return the statistics of all jobs in a dictionary with the job name as key.
+    def statistics(self):
+        statistics = {}
+        for job in self.jobs:
+            statistics[job.name] = job.statistics()
+        return statistics
+
+    # Time of the first deadline of all jobs.
+    def _next_deadline(self):
+        return min(job.deadline for job in self.jobs)
+
+    # Return the jobs that are due and the commands of all these jobs.
+    def _due_jobs(self, now):
+        due = []
+        commands = []
+        for job in self.jobs:
+            if job.deadline <= now + self.batch_window:
+                due.append(job)
+                commands.extend(job.commands)
+        return due, commands
+
+    # Register the start of the given jobs.
+    def _start(self, due, start):
+        for job in due:
+            job._started(start)
+
+    # Register the given exception for the given job. The run is counted as failure when not done already.
+    def _error(self, job, error, counted=False):
+        if not counted:
+            job.failures = job.failures + 1
+        job.last_error = error
+        self.errors = self.errors + 1
+        self.last_error = error
+
+    # Hand the results over to the jobs and set their next deadline.
+    def _finish(self, due, results):
+        self.exchanges = self.exchanges + 1
+        now = time.monotonic()
+        index = 0
+        for job in due:
+            job_results = results[index:index + len(job.commands)]
+            index = index + len(job.commands)
+            failed = not all(command_ok for command_ok, data in job_results)
+            if failed:
+                job.failures = job.failures + 1
+            job._advance(now)
+            if job.callback is not None:
+                try:
+                    job.callback(job, job_results)
+                except Exception as error:
+                    self._error(job, error, failed)
+
+    # The exchange of the given jobs failed with the given exception. Set their next deadline.
+    def _failed(self, due, error):
+        now = time.monotonic()
+        for job in due:
+            self._error(job, error)
+            job._advance(now)
+
+
+# Scheduler running the jobs in its own thread.
+class PeriodicScheduler(_SchedulerBase):
+    def __init__(self, serial_port=ser, batch_window=0.001):
+        _SchedulerBase.__init__(self, serial_port, batch_window)
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Start running the jobs in a background thread.
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    # Stop running the jobs.
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    # Run the jobs until stopped.
+    def run(self):
+        while not self._stop.is_set():
+            if not self.jobs:
+                self._stop.wait(0.01)
+                continue
+            delay = self._next_deadline() - time.monotonic()
+            if delay > 0:
+                if self._stop.wait(delay):
+                    break
+            start = time.monotonic()
+            due, commands = self._due_jobs(start)
+            if not due:
+                continue
+            self._start(due, start)
+            try:
+                results = command_exchange(commands, self.serial_port)
+            except Exception as error:
+                self._failed(due, error)
+                continue
+            self._finish(due, results)
+
+
+# Scheduler running the jobs as an asyncio task. The blocking serial I/O is done in an executor.
+class AsyncPeriodicScheduler(_SchedulerBase):
+    def __init__(self, serial_port=ser, batch_window=0.001):
+        _SchedulerBase.__init__(self, serial_port, batch_window)
+        self._running = False
+
+    # Stop running the jobs.
+    def stop(self):
+        self._running = False
+
+    # Run the jobs until stopped.
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._running = True
+        while self._running:
+            if not self.jobs:
+                await asyncio.sleep(0.01)
+                continue
+            delay = self._next_deadline() - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            start = time.monotonic()
+            due, commands = self._due_jobs(start)
+            self._start(due, start)
+            try:
+                results = await loop.run_in_executor(None, command_exchange, commands, self.serial_port)
+            except Exception as error:
+                self._failed(due, error)
+                continue
+            self._finish(due, results)
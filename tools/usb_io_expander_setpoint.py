@@ -0,0 +1,201 @@
+#
+# Title: USB IO Expander setpoint coalescer.
+#
+# Author: Rob Jansen, Copyright (c) 2024..2024, all rights reserved.
+#
+# Description: Python script for sending DAC, PWM duty cycle and output pin setpoints to the USB IO Expander
+#              on a last-writer-wins basis. Only the latest requested value per output is kept, values that
+#              were replaced before they could be sent are dropped and values that are already applied are
+#              not sent again. A background thread sends all pending setpoints in one pipelined exchange,
+#              either as fast as the device can handle them or at a configured rate. Since at most one
+#              exchange is in progress, the output latency stays bounded when the setpoints come in faster
+#              than they can be sent.
+#
+
+import threading
+import time
+from usb_io_expander import ser, command_exchange, command_encoders
+
+# Output keys.
+output_dac = ('dac',)
+output_pins = ('pins',)
+
+
+# Returns the output key of the given PWM channel (1 or 2).
+def output_pwm(channel):
+    return ('pwm', channel)
+
+
+# Returns the command for setting the given output to the given value or None when the value is not valid.
+def setpoint_command(output, value):
+    if output == output_dac:
+        return command_encoders['dac_write'](value)
+    elif output == output_pins:
+        return command_encoders['pin_byte_write'](value)
+    else:
+        return command_encoders['pwm_duty_cyle'](output[1], value)
+
+
+class SetpointCoalescer:
+    # When rate (updates per second) is None the setpoints are sent as fast as the device allows.
+    def __init__(self, serial_port=ser, rate=None):
+        self.serial_port = serial_port
+        self.rate = rate
+        self._condition = threading.Condition()
+        self._pending = {}        # Output -> (value, time of the oldest unsent request).
+        self._in_flight = {}      # Output -> value sent to the device but not yet confirmed.
+        self._applied = {}        # Output -> value confirmed by the device.
+        self._latest = {}         # Output -> (value, time) of the latest request.
+        self._busy = False
+        self._running = False
+        self._thread = None
+        # Statistics.
+        self.requested = 0        # Number of setpoints requested.
+        self.coalesced = 0        # Number of setpoints replaced by a newer one before being sent.
+        self.skipped = 0          # Number of setpoints not sent since the value was already applied.
+        self.rejected = 0         # Number of setpoints with an invalid value.
+        self.sent = 0             # Number of setpoints sent to the device.
+        self.failed = 0           # Number of setpoints not accepted by the device.
+        self.exchanges = 0        # Number of pipelined exchanges.
+        self.max_latency = 0.0    # Longest time in seconds from request to confirmation.
+
+    # Start the background thread that sends the setpoints.
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # Stop the background thread. Pending setpoints are sent first when flush is TRUE.
+    def stop(self, flush=True):
+        if flush:
+            self.flush()
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    # Wait until all pending setpoints are sent. Returns FALSE on timeout.
+    def flush(self, timeout=None):
+        with self._condition:
+            return self._condition.wait_for(lambda: not (self._pending or self._busy) or not self._running,
+                                            timeout)
+
+    # Returns the value the output will have when nothing more is sent, the value in flight or when
+    # nothing is in flight the applied value. Must be called with the condition locked.
+    def _expected(self, output):
+        if output in self._in_flight:
+            return self._in_flight[output]
+        return self._applied.get(output)
+
+    # Request the given value for the given output. Returns FALSE when the value is not valid, it is not
+    # sent and does not replace a pending value.
+    def set(self, output, value):
+        if setpoint_command(output, value) is None:
+            with self._condition:
+                self.requested = self.requested + 1
+                self.rejected = self.rejected + 1
+            return False
+        with self._condition:
+            self.requested = self.requested + 1
+            self._latest[output] = (value, time.monotonic())
+            if output in self._pending:
+                self.coalesced = self.coalesced + 1
+                request_time = self._pending[output][1]
+                if self._expected(output) == value:
+                    # Back to the value in flight or applied, nothing has to be sent anymore.
+                    del self._pending[output]
+                    self.skipped = self.skipped + 1
+                else:
+                    self._pending[output] = (value, request_time)
+            elif self._expected(output) == value:
+                self.skipped = self.skipped + 1
+            else:
+                self._pending[output] = self._latest[output]
+                self._condition.notify_all()
+        return True
+
+    # Set the DAC to the given value (0..31). Returns FALSE when the value is not valid.
+    def dac_write(self, value):
+        return self.set(output_dac, value)
+
+    # Set the PWM duty cycle (0..100) for the given channel (1 or 2). Returns FALSE when not valid.
+    def pwm_duty_cyle(self, channel, duty_cycle):
+        return self.set(output_pwm(channel), duty_cycle)
+
+    # Set the all pins (0..7) to the given bits in the parameter value (0..255).
+    # Returns FALSE when the value is not valid.
+    def pin_byte_write(self, value):
+        return self.set(output_pins, value)
+
+    # Forget the applied values, e.g. after a reset of the device so all setpoints are sent again.
+    def invalidate(self):
+        with self._condition:
+            self._applied = {}
+
+    # Return the statistics in a dictionary.
+    def statistics(self):
+        with self._condition:
+            return {'requested': self.requested, 'coalesced': self.coalesced, 'skipped': self.skipped,
+                    'rejected': self.rejected,
+                    'sent': self.sent, 'failed': self.failed, 'exchanges': self.exchanges,
+                    'pending': len(self._pending), 'max_latency': self.max_latency}
+
+    def _run(self):
+        next_send = time.monotonic()
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending or not self._running)
+                if not self._running:
+                    return
+            # Keep the configured rate. New setpoints received while waiting replace the pending ones.
+            if self.rate:
+                delay = next_send - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_send = max(next_send + (1.0 / self.rate), time.monotonic())
+            with self._condition:
+                pending = self._pending
+                self._pending = {}
+                for output, (value, request_time) in pending.items():
+                    self._in_flight[output] = value
+                self._busy = True
+            outputs = list(pending)
+            commands = []
+            for output in outputs:
+                commands.append(setpoint_command(output, pending[output][0]))
+            try:
+                results = command_exchange(commands, self.serial_port)
+            except Exception:
+                results = [(False, [])] * len(commands)
+            now = time.monotonic()
+            with self._condition:
+                self.exchanges = self.exchanges + 1
+                self.sent = self.sent + len(commands)
+                for output, (command_ok, data) in zip(outputs, results):
+                    value, request_time = pending[output]
+                    del self._in_flight[output]
+                    if command_ok:
+                        self._applied[output] = value
+                        # The latest request must win, send it when it differs from the confirmed value.
+                        latest_value, latest_time = self._latest[output]
+                        if (output not in self._pending) and (latest_value != value):
+                            self._pending[output] = (latest_value, latest_time)
+                    else:
+                        # Unknown what the output is now, a next request must be sent.
+                        self._applied.pop(output, None)
+                        self.failed = self.failed + 1
+                    self.max_latency = max(self.max_latency, now - request_time)
+                self._busy = False
+                self._condition.notify_all()
@@ -0,0 +1,180 @@
+#
+# Title: USB IO Expander shared memory publication.
+#
+# Author: Rob Jansen, Copyright (c) 2024..2024, all rights reserved.
+#
+# Description: Python script for sharing live ADC samples and pin states with other processes. Only one process
+#              can open the serial port. That process samples the ADC and the pins and writes the samples in
+#              a ring buffer in shared memory. Other processes map the same shared memory and read the samples
+#              without locks and without copying them, as NumPy views on the ring buffer. A sequence number in
+#              the header tells the subscribers how many samples were written so they can detect when the
+#              publisher overwrote samples before they were read (overrun).
+#              Note: This script requires NumPy.
+#
+# Shared memory layout:
+#   -) Header of 4 unsigned 64-bit words: number of samples written, capacity, record size, layout version.
+#   -) Ring buffer of capacity records: sequence number, time (time.time()), ADC value, port value and flags.
+#
+
+import time
+from multiprocessing import shared_memory, resource_tracker
+import numpy
+from usb_io_expander import ser, command_exchange
+
+sample_type = numpy.dtype([('sequence', numpy.uint64), ('time', numpy.float64), ('adc', numpy.uint16),
+                           ('pins', numpy.uint8), ('flags', numpy.uint8), ('reserved', numpy.uint32)])
+header_words = 4
+header_size = header_words * 8
+layout_version = 1
+# Flags of a sample.
+flag_adc_valid = 0x01
+flag_pins_valid = 0x02
+
+
+# Returns the header and the ring buffer as NumPy views on the given shared memory.
+def _map_buffer(shared_buffer, capacity):
+    header = numpy.ndarray((header_words,), dtype=numpy.uint64, buffer=shared_buffer.buf)
+    samples = numpy.ndarray((capacity,), dtype=sample_type, buffer=shared_buffer.buf, offset=header_size)
+    return header, samples
+
+
+# Publisher, writes samples in a new shared memory ring buffer with the given name.
+class SamplePublisher:
+    def __init__(self, name, capacity=65536):
+        self.capacity = capacity
+        self._shared_buffer = shared_memory.SharedMemory(name=name, create=True,
+                                                         size=header_size + (capacity * sample_type.itemsize))
+        self.name = self._shared_buffer.name
+        self._header, self._samples = _map_buffer(self._shared_buffer, capacity)
+        self._header[0] = 0
+        self._header[1] = capacity
+        self._header[2] = sample_type.itemsize
+        self._header[3] = layout_version
+        self.sequence = 0
+
+    # Write one sample. A value None means that the value is not valid.
+    def publish(self, adc=None, pins=None, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        flags = 0
+        sample = self._samples[self.sequence % self.capacity]
+        sample['sequence'] = self.sequence
+        sample['time'] = timestamp
+        if adc is not None:
+            sample['adc'] = adc
+            flags = flags | flag_adc_valid
+        if pins is not None:
+            sample['pins'] = pins
+            flags = flags | flag_pins_valid
+        sample['flags'] = flags
+        # The sample is complete, now make it visible for the subscribers.
+        self.sequence = self.sequence + 1
+        self._header[0] = self.sequence
+
+    # Close the shared memory and remove it.
+    def close(self):
+        self._header = None
+        self._samples = None
+        self._shared_buffer.close()
+        self._shared_buffer.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Subscriber, reads the samples from the shared memory ring buffer with the given name.
+class SampleSubscriber:
+    # When from_start is FALSE only samples written after subscribing are read.
+    def __init__(self, name, from_start=False):
+        try:
+            # Do not let the resource tracker remove the shared memory when this process ends (Python 3.13+).
+            self._shared_buffer = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            self._shared_buffer = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(self._shared_buffer._name, 'shared_memory')
+        header = numpy.ndarray((header_words,), dtype=numpy.uint64, buffer=self._shared_buffer.buf)
+        if (header[3] != layout_version) or (header[2] != sample_type.itemsize):
+            raise ValueError("Shared memory has an unknown layout: " + name)
+        self.capacity = int(header[1])
+        self._header, self._samples = _map_buffer(self._shared_buffer, self.capacity)
+        if from_start:
+            self.next_sequence = max(0, int(self._header[0]) - self.capacity)
+        else:
+            self.next_sequence = int(self._header[0])
+        self._read_sequence = self.next_sequence
+        self.lost = 0
+
+    # Return the new samples as a list of at most two NumPy views (the ring buffer may wrap) and the
+    # number of samples that were overwritten before they could be read.
+    def read(self):
+        written = int(self._header[0])
+        lost = 0
+        if written - self.next_sequence > self.capacity:
+            lost = written - self.next_sequence - self.capacity
+            self.next_sequence = written - self.capacity
+            self.lost = self.lost + lost
+        views = []
+        first = self.next_sequence
+        while first < written:
+            index = first % self.capacity
+            count = min(written - first, self.capacity - index)
+            views.append(self._samples[index:index + count])
+            first = first + count
+        self._read_sequence = self.next_sequence
+        self.next_sequence = written
+        return views, lost
+
+    # Returns TRUE when samples of the last read were overwritten by the publisher in the meantime,
+    # the data of the views of the last read are then no longer valid.
+    def overrun(self):
+        return int(self._header[0]) - self._read_sequence > self.capacity
+
+    # Close the shared memory. Views returned by read must not be used anymore.
+    def close(self):
+        self._header = None
+        self._samples = None
+        self._shared_buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Sample the ADC and the port with the given rate (samples per second, None for as fast as possible) and
+# publish the samples. The ADC and the pins must be initialized. Runs until the duration (seconds) has passed
+# or forever when no duration is given. Returns the number of published samples.
+def publish_samples(publisher, serial_port=ser, rate=None, duration=None, adc=True, pins=True):
+    commands = []
+    if adc:
+        commands.append('!ADCR')
+    if pins:
+        commands.append('!PYR')
+    start_time = time.monotonic()
+    deadline = start_time
+    samples = 0
+    while (duration is None) or (time.monotonic() - start_time < duration):
+        if rate:
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            deadline = max(deadline + (1.0 / rate), time.monotonic())
+        timestamp = time.time()
+        results = command_exchange(commands, serial_port)
+        adc_value = None
+        pins_value = None
+        if adc:
+            command_ok, adc_data = results.pop(0)
+            if command_ok and (len(adc_data) == 2):
+                adc_value = (adc_data[0] * 256) + adc_data[1]
+        if pins:
+            command_ok, port_data = results.pop(0)
+            if command_ok and (len(port_data) == 1):
+                pins_value = port_data[0]
+        publisher.publish(adc_value, pins_value, timestamp)
+        samples = samples + 1
+    return samples
@@ -0,0 +1,257 @@
+#
+# Title: USB IO Expander virtual wide ports.
+#
+# Author: Rob Jansen, Copyright (c) 2024..2024, all rights reserved.
+#
+# Description: Python script for combining the 8 pins of the USB IO Expander and MCP23008 (IIC) and MCP23S08 (SPI)
+#              port expanders into one wide digital port of 16 to 64 bits. Each logical bit is mapped onto a bit
+#              of a physical port. A write of the wide port is split into one transfer per physical port that
+#              changes, a read gathers all physical ports involved. All transfers of one operation are sent in
+#              one pipelined exchange. The number of commands each operation cost is reported.
+#              Note: The IIC or SPI interface must be initialized before using a port expander. For the MCP23S08
+#              the device select pin must be set to a digital output, see Test_SPI_MCP23S08.py.
+#
+
+from usb_io_expander import ser, command_exchange, command_encoders
+
+# MCP23008 and MCP23S08 registers.
+mcp_iodir = 0x00
+mcp_gpio = 0x09
+
+
+# Returns the command of the command table with the given name and arguments. Raises ValueError when an
+# argument is not valid, the firmware would otherwise truncate it and address the wrong device or pin.
+def _command(name, *arguments):
+    command = command_encoders[name](*arguments)
+    if command is None:
+        raise ValueError('invalid arguments for {}: {}'.format(name, arguments))
+    return command
+
+
+# The 8 pins of the USB IO Expander. Pins in keep_high are always outputs that are written high, e.g. the device
+# select pin of an MCP23S08. The direction is tracked, all pins except keep_high are assumed input until set.
+# When all 8 pins are input the port is read with one pin byte read, otherwise the needed input pins are read
+# with a pin bit read each since the firmware does not allow a pin byte read when a pin is output. The value
+# of an output pin is the value last written.
+class NativePort:
+    def __init__(self, keep_high=0x00):
+        _command('pin_byte_write', keep_high)
+        self.keep_high = keep_high
+        self.name = 'native'
+        self.inputs = ~keep_high & 0xFF
+        self.outputs_value = keep_high
+
+    # Commands for setting the direction of the pins (bit 0 = output, bit 1 = input).
+    def direction_commands(self, direction):
+        self.inputs = direction & ~self.keep_high & 0xFF
+        return [_command('pin_byte_direction', self.inputs)]
+
+    def write_commands(self, value):
+        self.outputs_value = value | self.keep_high
+        return [_command('pin_byte_write', self.outputs_value)]
+
+    # Returns the input pins that are read for the given bits.
+    def _read_pins(self, bits):
+        return [pin for pin in range(8) if (bits & self.inputs) & (1 << pin)]
+
+    # Commands for reading the given bits of the port.
+    def read_commands(self, bits=0xFF):
+        if self.inputs == 0xFF:
+            return [_command('pin_byte_read')]
+        return [_command('pin_bit_read', pin) for pin in self._read_pins(bits)]
+
+    # Returns TRUE and the port value from the results of the read commands for the given bits.
+    def read_value(self, results, bits=0xFF):
+        if self.inputs == 0xFF:
+            command_ok, data = results[0]
+            if command_ok and (len(data) == 1):
+                return True, data[0]
+            return False, 0
+        value = self.outputs_value & ~self.inputs & 0xFF
+        all_ok = True
+        for pin, (command_ok, data) in zip(self._read_pins(bits), results):
+            if command_ok and (len(data) == 1):
+                value = value | ((data[0] & 0x01) << pin)
+            else:
+                all_ok = False
+        return all_ok, value
+
+
+# MCP23008 IIC port expander at the given (8-bit) slave address. Raises ValueError for an invalid address.
+class MCP23008Port:
+    def __init__(self, slave_address=0x40):
+        _command('iic_read', slave_address, 1)
+        self.slave_address = slave_address
+        self.name = 'mcp23008@{:02X}'.format(slave_address)
+
+    def direction_commands(self, direction):
+        return [_command('iic_write', self.slave_address, [mcp_iodir, direction])]
+
+    def write_commands(self, value):
+        return [_command('iic_write', self.slave_address, [mcp_gpio, value])]
+
+    def read_commands(self, bits=0xFF):
+        return [_command('iic_write', self.slave_address, [mcp_gpio]), _command('iic_read', self.slave_address, 1)]
+
+    def read_value(self, results, bits=0xFF):
+        command_ok, data = results[1]
+        if results[0][0] and command_ok and (len(data) == 1):
+            return True, data[0]
+        return False, 0
+
+
+# MCP23S08 SPI port expander with the given (write) address and device select pin of the USB IO Expander.
+# Raises ValueError for an invalid address or pin.
+class MCP23S08Port:
+    def __init__(self, address=0x40, select_pin=3):
+        _command('spi_write', [address, address | 0x01])
+        _command('pin_bit_write', select_pin, 0)
+        self.address = address
+        self.select_pin = select_pin
+        self.name = 'mcp23s08@{:02X}'.format(address)
+
+    # Commands for one SPI transfer with the device selected.
+    def _transfer(self, commands):
+        return ([_command('pin_bit_write', self.select_pin, 0)] + commands +
+                [_command('pin_bit_write', self.select_pin, 1)])
+
+    def direction_commands(self, direction):
+        return self._transfer([_command('spi_write', [self.address, mcp_iodir, direction])])
+
+    def write_commands(self, value):
+        return self._transfer([_command('spi_write', [self.address, mcp_gpio, value])])
+
+    def read_commands(self, bits=0xFF):
+        return self._transfer([_command('spi_write', [self.address | 0x01, mcp_gpio]), _command('spi_read', 1)])
+
+    def read_value(self, results, bits=0xFF):
+        command_ok, data = results[2]
+        if all(result[0] for result in results) and (len(data) == 1):
+            return True, data[0]
+        return False, 0
+
+
+# A wide port. The mapping is a list of (physical port, bit) per logical bit, logical bit 0 first.
+class WidePort:
+    def __init__(self, mapping, serial_port=ser):
+        self.mapping = list(mapping)
+        self.serial_port = serial_port
+        self.ports = []
+        for port, bit in self.mapping:
+            if port not in self.ports:
+                self.ports.append(port)
+        # Last value written per physical port, None when not known. Bits of a physical port that are
+        # not written are taken from this shadow, or 0 when not known.
+        self.shadow = {}
+        # Statistics of the last operation and totals.
+        self.last_commands = 0
+        self.last_ports = 0
+        self.operations = 0
+        self.total_commands = 0
+
+    # Returns a wide port using all 8 bits of the given physical ports, the first port for the lowest bits.
+    @staticmethod
+    def from_ports(ports, serial_port=ser):
+        mapping = []
+        for port in ports:
+            for bit in range(8):
+                mapping.append((port, bit))
+        return WidePort(mapping, serial_port)
+
+    # Number of logical bits.
+    def width(self):
+        return len(self.mapping)
+
+    # Split the given logical value into a value per physical port. Only bits in the mask are used.
+    def _split(self, value, mask):
+        port_values = {}
+        for logical_bit, (port, bit) in enumerate(self.mapping):
+            if not (mask >> logical_bit) & 0x01:
+                continue
+            if port not in port_values:
+                port_values[port] = self.shadow.get(port) or 0
+            if (value >> logical_bit) & 0x01:
+                port_values[port] = port_values[port] | (1 << bit)
+            else:
+                port_values[port] = port_values[port] & ~(1 << bit)
+        return port_values
+
+    def _exchange(self, port_commands):
+        commands = []
+        for port, port_command_list in port_commands:
+            commands.extend(port_command_list)
+        self.last_commands = len(commands)
+        self.last_ports = len(port_commands)
+        self.operations = self.operations + 1
+        self.total_commands = self.total_commands + len(commands)
+        if not commands:
+            return [[] for port_command in port_commands]
+        results = command_exchange(commands, self.serial_port)
+        port_results = []
+        index = 0
+        for port, port_command_list in port_commands:
+            port_results.append(results[index:index + len(port_command_list)])
+            index = index + len(port_command_list)
+        return port_results
+
+    # Set the direction of the logical bits (0 = output, 1 = input). Returns TRUE when successful.
+    # Bits of a physical port that are not mapped are set to input.
+    def set_direction(self, direction):
+        port_directions = {}
+        for port in self.ports:
+            port_directions[port] = 0xFF
+        for logical_bit, (port, bit) in enumerate(self.mapping):
+            if not (direction >> logical_bit) & 0x01:
+                port_directions[port] = port_directions[port] & ~(1 << bit)
+        port_commands = [(port, port.direction_commands(port_directions[port])) for port in self.ports]
+        results = self._exchange(port_commands)
+        return all(command_ok for port_results in results for command_ok, data in port_results)
+
+    # Write the given value to the logical bits in the mask (default all bits). Only physical ports that
+    # change are written. Returns TRUE when successful.
+    def write(self, value, mask=None):
+        if mask is None:
+            mask = (1 << len(self.mapping)) - 1
+        port_values = self._split(value, mask)
+        port_commands = []
+        for port in self.ports:
+            if (port in port_values) and (port_values[port] != self.shadow.get(port)):
+                port_commands.append((port, port.write_commands(port_values[port])))
+        results = self._exchange(port_commands)
+        all_ok = True
+        for (port, commands), port_results in zip(port_commands, results):
+            if all(command_ok for command_ok, data in port_results):
+                self.shadow[port] = port_values[port]
+            else:
+                self.shadow.pop(port, None)
+                all_ok = False
+        return all_ok
+
+    # Returns the mapped bits of the given physical port.
+    def _port_bits(self, port):
+        bits = 0
+        for mapped_port, bit in self.mapping:
+            if mapped_port is port:
+                bits = bits | (1 << bit)
+        return bits
+
+    # Read all logical bits in one exchange. Returns TRUE and the value when successful.
+    def read(self):
+        port_commands = [(port, port.read_commands(self._port_bits(port))) for port in self.ports]
+        results = self._exchange(port_commands)
+        port_values = {}
+        all_ok = True
+        for (port, commands), port_results in zip(port_commands, results):
+            command_ok, port_value = port.read_value(port_results, self._port_bits(port))
+            all_ok = all_ok and command_ok
+            port_values[port] = port_value
+        value = 0
+        for logical_bit, (port, bit) in enumerate(self.mapping):
+            if (port_values[port] >> bit) & 0x01:
+                value = value | (1 << logical_bit)
+        return all_ok, value
+
+    # Return the statistics of the last operation and the totals in a dictionary.
+    def statistics(self):
+        return {'last_commands': self.last_commands, 'last_ports': self.last_ports,
+                'operations': self.operations, 'total_commands': self.total_commands}